@@ -0,0 +1,29 @@
+"""
+Admin authentication for operational endpoints (profiling, reloads, ...).
+
+Admin calls carry the shared secret from the ADMIN_TOKEN environment variable
+in the `X-Admin-Token` header. When ADMIN_TOKEN is unset, admin features are
+disabled entirely.
+"""
+
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+ADMIN_HEADER = "X-Admin-Token"
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """True if token matches ADMIN_TOKEN (constant-time comparison)."""
+    expected = os.environ.get("ADMIN_TOKEN")
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """FastAPI dependency rejecting callers without a valid admin token."""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
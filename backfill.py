@@ -0,0 +1,393 @@
+"""
+Offline skill re-extraction (backfill) after a skill DB change.
+
+Instead of looping over /skillboy over HTTP, this loads the extractor in
+process and runs it over a process pool. Each worker parses its chunk of
+texts with nlp.pipe (see _extract_batch).
+
+Sources:
+- MongoDB: results are written back with bulk updates, in _id order. `skills`
+  is replaced (keeping the seniority of skills already listed) and
+  `skills_db_version` is set. A document edited since it was read is skipped
+  (version check, see updates.py) and reported, so a manual edit is never overwritten.
+- NDJSON file (e.g. requests.jsonl): results are appended to an NDJSON output file.
+
+Progress is checkpointed after every written chunk: re-running the same command
+resumes where it stopped. Use --restart to start over.
+
+    python backfill.py mongo [--collection StagingRFP] [--query '{"isActive": true}']
+    python backfill.py requests.jsonl --text-field title --text-field body --id-field request_id
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from functools import lru_cache
+
+from skillNer.cleaner import Cleaner, stem_text
+
+from skill_engine import SKILL_DB_PATH, TOKEN_DIST_PATH, SkillEngine, db_version
+from test import extract_skills
+from updates import VERSION_FIELD, doc_version, version_filter
+
+DEFAULT_CHECKPOINT = "backfill.checkpoint.json"
+
+# Loaded once per worker process (or inherited from the parent when forked)
+_engine = None
+
+
+def _init_worker(skill_db_path: str, compact: bool):
+    global _engine
+    if _engine is None:
+        _engine = SkillEngine.load(skill_db_path, cache_size=0, compact=compact)
+
+
+def _extract_chunk(texts, batch_size):
+    return _extract_batch(texts, _engine.extractor, batch_size)
+
+
+# ==========================================================
+# Batched extraction (nlp.pipe)
+# ==========================================================
+# Same preprocessing as skillNer's Text before it calls nlp()
+_skillner_cleaner = Cleaner(include_cleaning_functions=["remove_punctuation", "remove_extra_space"], to_lowercase=False)
+# Porter stemming is most of the cost of building skillNer's Text; words repeat a lot
+_stem = lru_cache(maxsize=65536)(stem_text)
+
+
+class _PreparedDocs:
+    """Stands in for nlp in skillNer: returns the docs parsed in advance by nlp.pipe, parses anything else."""
+
+    def __init__(self, nlp, docs):
+        self.nlp = nlp
+        self.docs = docs
+
+    def __call__(self, text):
+        doc = self.docs.get(text)
+        return doc if doc is not None else self.nlp(text)
+
+    def pipe(self, texts, batch_size):
+        """Parse the texts not parsed yet, in batches."""
+        new = [text for text in dict.fromkeys(texts) if text not in self.docs]
+        self.docs.update(zip(new, self.nlp.pipe(new, batch_size=batch_size)))
+
+    def __getattr__(self, name):
+        return getattr(self.nlp, name)
+
+
+def _extract_batch(texts, extractor, batch_size):
+    """extract_skills for many texts, parsing them with nlp.pipe (batched) instead of one nlp() call each.
+
+    skillNer parses every text six times: the cleaned text (Text), then its lemmed,
+    abbreviation, cleaned, lemmed and stemmed forms (one per matcher). The lemmed and
+    stemmed forms come from the first parse, so it is piped first and the other forms
+    in a second pass. Only Utils.one_gram_sim, which depends on the matches, still
+    parses one by one.
+
+    Swaps the nlp of the extractor, its skill getters and utils for the duration
+    of the call, so it is only used on a worker's own engine: each pool process
+    runs one task at a time and the engine is never shared with the API.
+    """
+    nlp = extractor.nlp
+    prepared = _PreparedDocs(nlp, {})
+    abv_texts = [_skillner_cleaner(text) for text in texts]
+    cleaned = [text.lower() for text in abv_texts]
+    prepared.pipe(cleaned, batch_size)
+    # Text.lemmed() / Text.stemmed(), from the same parse
+    forms = []
+    for text in cleaned:
+        doc = prepared(text)
+        forms.append(" ".join(token.lemma_ for token in doc))
+        forms.append(" ".join(_stem(token.text) for token in doc))
+    prepared.pipe(forms + abv_texts, batch_size)
+
+    components = [extractor, extractor.skill_getters, extractor.utils]
+    for component in components:
+        component.nlp = prepared
+    try:
+        return [extract_skills(text, extractor) for text in texts]
+    finally:
+        for component in components:
+            component.nlp = nlp
+
+
+# ==========================================================
+# Checkpoint
+# ==========================================================
+class Checkpoint:
+    """Resume position for one (source, skill DB version), saved atomically as JSON."""
+
+    def __init__(self, path: str, source: str, skill_db: str, restart: bool = False):
+        self.path = path
+        self.state = {"source": source, "skill_db": skill_db, "position": None, "done": 0}
+        if restart or not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if (saved.get("source"), saved.get("skill_db")) == (source, skill_db):
+            self.state = saved
+            print(f"🔄 Resuming after {saved['done']} documents")
+        else:
+            print(f"[WARN] Checkpoint {path} is for {saved.get('source')} / skill DB {saved.get('skill_db')}, starting over")
+
+    @property
+    def position(self):
+        return self.state["position"]
+
+    @property
+    def done(self) -> int:
+        return self.state["done"]
+
+    def save(self, position, done: int):
+        self.state.update(position=position, done=done)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+# ==========================================================
+# Sources
+# ==========================================================
+class MongoSource:
+    """Documents of a collection in _id order; the checkpoint position is the last written _id."""
+
+    def __init__(self, collection, query: dict, text_fields, field: str):
+        self.collection = collection
+        self.query = query
+        self.text_fields = text_fields
+        self.field = field
+        self.name = f"mongo:{collection.name}:{json.dumps(query, sort_keys=True)}:{field}"
+        self.conflicts = []
+
+    def total(self) -> int:
+        return self.collection.count_documents(self.query)
+
+    def items(self, position):
+        """Yields (position, doc, text) after position."""
+        from bson.objectid import ObjectId
+
+        query = dict(self.query)
+        if position is not None:
+            query = {"$and": [self.query, {"_id": {"$gt": ObjectId(position)}}]}
+        projection = {field: 1 for field in self.text_fields}
+        projection.update({self.field: 1, VERSION_FIELD: 1})
+        for doc in self.collection.find(query, projection).sort("_id", 1):
+            yield str(doc["_id"]), doc, _join_text(doc, self.text_fields)
+
+    def write(self, docs, results, version: str):
+        """Bulk update one chunk."""
+        from pymongo import UpdateOne
+
+        ops = []
+        for doc, names in zip(docs, results):
+            current = doc.get(self.field) or []
+            seniority = {s.get("name"): s.get("seniority", "") for s in current if isinstance(s, dict)}
+            skills = [{"name": name, "seniority": seniority.get(name, "")} for name in names]
+            update = {"$set": {"skills_db_version": version}}
+            if skills != current:
+                update["$set"][self.field] = skills
+                update["$inc"] = {VERSION_FIELD: 1}
+            ops.append(UpdateOne({"_id": doc["_id"], **version_filter(doc_version(doc))}, update))
+        if ops:
+            result = self.collection.bulk_write(ops, ordered=False)
+            if result.matched_count < len(ops):
+                self._record_conflicts(docs, version)
+
+    def checkpoint_position(self, position):
+        return position
+
+    def _record_conflicts(self, docs, version: str):
+        # Edited between our read and our write: left as the editor saved it
+        ids = [doc["_id"] for doc in docs]
+        stamped = {d["_id"] for d in self.collection.find({"_id": {"$in": ids}, "skills_db_version": version}, {"_id": 1})}
+        self.conflicts.extend(str(i) for i in ids if i not in stamped)
+
+
+class NdjsonSource:
+    """Lines of an NDJSON file; results are appended to an NDJSON output file.
+
+    The checkpoint position is (lines read, output size): on resume the output is
+    truncated back to the last checkpoint, so no result is written twice.
+    """
+
+    def __init__(self, path: str, output: str, text_fields, id_field: str):
+        self.path = path
+        self.output = output
+        self.text_fields = text_fields
+        self.id_field = id_field
+        self.name = f"ndjson:{os.path.abspath(path)}"
+        self.conflicts = []
+        self._out = None
+
+    def total(self) -> int:
+        with open(self.path, "rb") as f:
+            return sum(1 for line in f if line.strip())
+
+    def items(self, position):
+        """Yields (lines read, doc, text) after position."""
+        lines, size = position or (0, 0)
+        self._out = open(self.output, "a+b")
+        self._out.truncate(size)
+        with open(self.path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f):
+                if number < lines or not line.strip():
+                    continue
+                doc = json.loads(line)
+                yield number + 1, doc, _join_text(doc, self.text_fields)
+
+    def write(self, docs, results, version: str):
+        for doc, names in zip(docs, results):
+            record = {"id": doc.get(self.id_field), "skills": names, "skills_db_version": version}
+            self._out.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._out.flush()
+        os.fsync(self._out.fileno())
+
+    def checkpoint_position(self, position):
+        return [position, self._out.tell()]
+
+
+def _join_text(doc: dict, fields) -> str:
+    return "\n".join(str(doc.get(field) or "") for field in fields).strip()
+
+
+# ==========================================================
+# Run
+# ==========================================================
+def _format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+class Progress:
+    """Done / total, throughput and ETA on stderr, at most every `interval` seconds."""
+
+    def __init__(self, total: int, done: int = 0, interval: float = 2.0):
+        self.total = total
+        self.done = done
+        self.start_done = done
+        self.interval = interval
+        self.start = self.last = time.monotonic()
+        self.tty = sys.stderr.isatty()
+
+    def update(self, count: int, force: bool = False):
+        self.done += count
+        now = time.monotonic()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        rate = (self.done - self.start_done) / max(now - self.start, 1e-9)
+        remaining = max(self.total - self.done, 0)
+        eta = _format_seconds(remaining / rate) if rate > 0 else "?"
+        percent = 100 * self.done / self.total if self.total else 100.0
+        line = f"[backfill] {self.done}/{self.total} ({percent:.1f}%) {rate:.1f} docs/s ETA {eta}"
+        print(f"\r{line}" if self.tty else line, end="" if self.tty else "\n", file=sys.stderr, flush=True)
+
+    def finish(self):
+        self.update(0, force=True)
+        if self.tty:
+            print(file=sys.stderr)
+
+
+def _chunks(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(source, checkpoint: Checkpoint, version: str, pool, workers: int, chunk_size: int, batch_size: int):
+    progress = Progress(source.total(), checkpoint.done)
+    in_flight = deque()  # (position after the chunk, docs, AsyncResult), in source order
+
+    def write_oldest():
+        position, docs, pending = in_flight.popleft()
+        source.write(docs, pending.get(), version)
+        progress.update(len(docs))
+        checkpoint.save(source.checkpoint_position(position), progress.done)
+
+    for chunk in _chunks(source.items(checkpoint.position), chunk_size):
+        texts = [text for _, _, text in chunk]
+        task = pool.apply_async(_extract_chunk, (texts, batch_size))
+        in_flight.append((chunk[-1][0], [doc for _, doc, _ in chunk], task))
+        # Bounded read-ahead: keep every worker busy without loading the whole source
+        while len(in_flight) > 2 * workers:
+            write_oldest()
+    while in_flight:
+        write_oldest()
+    progress.finish()
+    return progress.done - progress.start_done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-extract skills for stored RFPs (offline backfill)")
+    parser.add_argument("source", help='"mongo", or the path of an NDJSON file')
+    parser.add_argument("--collection", help="MongoDB collection (default: the RFP collection)")
+    parser.add_argument("--query", default="{}", help="MongoDB filter as JSON (default: all documents)")
+    parser.add_argument("--field", default="skills", help="MongoDB field to write the skills to")
+    parser.add_argument("--text-field", action="append", dest="text_fields",
+                        help="Field(s) holding the text, joined by newlines (default: job_desc)")
+    parser.add_argument("--id-field", default="job_id", help="NDJSON: field copied to the output as id")
+    parser.add_argument("--output", help="NDJSON: output file (default: <source>.skills.ndjson)")
+    parser.add_argument("--skill-db", default=SKILL_DB_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=64, help="Documents per worker task")
+    parser.add_argument("--batch-size", type=int, default=32, help="nlp.pipe batch size")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args(argv)
+    text_fields = args.text_fields or ["job_desc"]
+    compact = os.environ.get("SKILL_DB_COMPACT", "0") == "1"
+
+    # Load once in the parent: forked workers share it (see serve.py), spawned ones load their own
+    start = time.perf_counter()
+    fork = "fork" in multiprocessing.get_all_start_methods()
+    global _engine
+    if fork:
+        _engine = SkillEngine.load(args.skill_db, cache_size=0, compact=compact)
+        version = _engine.version
+        gc.freeze()
+    else:
+        version = db_version((args.skill_db, TOKEN_DIST_PATH))
+    print(f"✅ Skill DB {version} loaded in {time.perf_counter() - start:.1f}s, {args.workers} workers")
+
+    # Pool before any MongoClient, so no client is inherited across fork
+    context = multiprocessing.get_context("fork" if fork else "spawn")
+    with context.Pool(args.workers, initializer=_init_worker, initargs=(args.skill_db, compact)) as pool:
+        if args.source == "mongo":
+            from pymongo import MongoClient
+            from params import MONGO_URI, DB_NAME, COLLECTION_NAME
+
+            collection = MongoClient(MONGO_URI)[DB_NAME][args.collection or COLLECTION_NAME]
+            source = MongoSource(collection, json.loads(args.query), text_fields, args.field)
+        else:
+            output = args.output or f"{args.source}.skills.ndjson"
+            source = NdjsonSource(args.source, output, text_fields, args.id_field)
+
+        checkpoint = Checkpoint(args.checkpoint, source.name, version, restart=args.restart)
+        start = time.perf_counter()
+        processed = run(source, checkpoint, version, pool, args.workers, args.chunk_size, args.batch_size)
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {processed} documents in {_format_seconds(elapsed)} ({processed / max(elapsed, 1e-9):.1f} docs/s)")
+    if source.conflicts:
+        rerun = json.dumps({"$and": [json.loads(args.query), {"skills_db_version": {"$ne": version}}]})
+        print(f"⚠️ {len(source.conflicts)} documents were edited during the backfill and left unchanged: "
+              f"{', '.join(source.conflicts[:10])}")
+        collection = f" --collection {args.collection}" if args.collection else ""
+        print(f"   To include them: python backfill.py mongo{collection} --restart --query '{rerun}'")
+
+
+if __name__ == "__main__":
+    main()
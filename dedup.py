@@ -0,0 +1,219 @@
+"""
+Near-duplicate detection for staging ingest (MinHash + LSH).
+
+The same tender often reaches staging from several service providers with
+slightly different descriptions. Each job_desc is reduced to a MinHash
+signature (NUM_PERM minimum hashes of its word 3-grams), whose agreement
+rate estimates the Jaccard similarity of the two texts. An LSH index splits
+signatures into bands and only compares documents sharing a band, so a
+lookup touches a handful of candidates instead of the whole collection.
+
+The index lives in memory and is rebuilt from the staging collection at
+startup. Before each lookup it also picks up documents inserted since
+(e.g. by other serve.py workers), so it stays current across processes.
+
+numpy is imported on first use, so importing this module (and main.py) stays fast.
+"""
+
+import hashlib
+import re
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson.objectid import ObjectId
+
+if TYPE_CHECKING:
+    import numpy as np
+
+NUM_PERM = 128
+SHINGLE_SIZE = 3
+# Permutations (a * x + b) mod MERSENNE_PRIME, as in the classic MinHash construction;
+# a, b < 2**32 keep a * x + b within uint64 for 32-bit shingle hashes
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+@lru_cache(maxsize=None)
+def _permutations():
+    """(a, b) coefficients. Fixed seed: signatures must be comparable across workers and restarts."""
+    import numpy as np
+
+    rng = np.random.RandomState(1)
+    return (rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64),
+            rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64))
+
+
+_WORD = re.compile(r"\w+")
+
+
+def shingles(text: str) -> Set[str]:
+    """Word n-grams of the normalized text (lowercase, punctuation removed)."""
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text: str) -> Optional["np.ndarray"]:
+    """NUM_PERM-value MinHash signature of text, or None for empty text."""
+    import numpy as np
+
+    grams = shingles(text or "")
+    if not grams:
+        return None
+    perm_a, perm_b = _permutations()
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams),
+        dtype=np.uint64, count=len(grams),
+    )
+    permuted = (np.outer(hashes, perm_a) + perm_b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def similarity(a: "np.ndarray", b: "np.ndarray") -> float:
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    import numpy as np
+
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def _area(y: "np.ndarray", x: "np.ndarray") -> float:
+    """Trapezoidal integral of y over x."""
+    import numpy as np
+
+    return float(np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2)
+
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM) -> Tuple[int, int]:
+    """(bands, rows) minimizing false positives below and false negatives above threshold.
+
+    A pair with similarity s shares at least one band with probability 1 - (1 - s^r)^b.
+    """
+    import numpy as np
+
+    s = np.linspace(0, 1, 201)
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        candidate = 1 - (1 - s ** rows) ** bands
+        # Area of false positives below the threshold plus false negatives above it
+        error = _area(np.where(s < threshold, candidate, 0), s) + _area(np.where(s >= threshold, 1 - candidate, 0), s)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class LSHIndex:
+    """Banded LSH over MinHash signatures, keyed by document id."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold)
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[str, "np.ndarray"] = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __contains__(self, key: str):
+        return key in self._signatures
+
+    def _band_keys(self, signature: "np.ndarray"):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: str, signature: "np.ndarray"):
+        self.remove(key)
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band, band_key in self._band_keys(signature):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def query(self, signature: "np.ndarray") -> List[Tuple[str, float]]:
+        """Documents at or above the threshold, most similar first."""
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        matches = [(key, similarity(signature, self._signatures[key])) for key in candidates]
+        return sorted((m for m in matches if m[1] >= self.threshold), key=lambda m: -m[1])
+
+
+class DuplicateDetector:
+    """LSH index over a collection's job_desc, kept in sync with inserts from any process."""
+
+    # Look back this far when catching up, since ObjectIds from other processes
+    # are only roughly ordered by time
+    SYNC_OVERLAP = timedelta(seconds=10)
+
+    def __init__(self, get_collection: Callable, threshold: float = 0.8):
+        self.get_collection = get_collection
+        self.threshold = threshold
+        self.index: Optional[LSHIndex] = None  # created by build()
+        self.ready = False
+        self._watermark: Optional[ObjectId] = None
+        self._lock = threading.RLock()
+
+    def build(self):
+        """(Re)build the index from every document in the collection."""
+        with self._lock:
+            self.index = LSHIndex(self.threshold)
+            self._watermark = None
+            self._load(self.get_collection().find({}, {"job_desc": 1}))
+            self.ready = True
+
+    def sync(self):
+        """Add documents inserted since the last build/sync (by this or another process)."""
+        if self._watermark is None:
+            query = {}
+        else:
+            since = ObjectId.from_datetime(self._watermark.generation_time - self.SYNC_OVERLAP)
+            query = {"_id": {"$gte": since}}
+        self._load(self.get_collection().find(query, {"job_desc": 1}), skip_known=True)
+
+    def _load(self, docs: Iterable[dict], skip_known: bool = False):
+        for doc in docs:
+            key = str(doc["_id"])
+            if self._watermark is None or doc["_id"] > self._watermark:
+                self._watermark = doc["_id"]
+            if skip_known and key in self.index:
+                continue
+            signature = minhash(doc.get("job_desc", ""))
+            if signature is not None:
+                self.index.add(key, signature)
+
+    def find(self, signature: Optional["np.ndarray"]) -> Optional[Tuple[str, float]]:
+        """Best existing match (id, similarity) for a signature, or None. Caller holds `lock`."""
+        if signature is None:
+            return None
+        if not self.ready:
+            self.build()
+        else:
+            self.sync()
+        matches = self.index.query(signature)
+        return matches[0] if matches else None
+
+    def add(self, key, signature: Optional["np.ndarray"]):
+        # Before the first build the document is picked up by build() itself
+        if signature is not None and self.index is not None:
+            self.index.add(str(key), signature)
+
+    def remove(self, key):
+        if self.index is not None:
+            self.index.remove(str(key))
+
+    @property
+    def lock(self):
+        """Hold while checking and inserting, so concurrent copies can't both miss each other."""
+        return self._lock
@@ -0,0 +1,216 @@
+"""
+Local stand-in for the Microsoft Graph mail API.
+
+Usage:
+    python graph_stub.py --port 8025 [--latency 0.2] [--fail-rate 0.1] [--throttle-rate 0.05]
+
+Then run the API against it:
+    GRAPH_URL=http://127.0.0.1:8025/v1.0 GRAPH_STATIC_TOKEN=stub uvicorn main:app
+
+Both `sendMail` and the draft + upload-session flow used for large attachments
+are supported. Accepted messages can be inspected with `GET /_stub/sent` and cleared with
+`DELETE /_stub/sent`.
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEND_MAIL = re.compile(r"^/v1\.0/users/([^/]+)/sendMail$")
+MESSAGES = re.compile(r"^/v1\.0/users/([^/]+)/messages$")
+MESSAGE = re.compile(r"^/v1\.0/users/([^/]+)/messages/([^/]+)$")
+SEND_DRAFT = re.compile(r"^/v1\.0/users/([^/]+)/messages/([^/]+)/send$")
+UPLOAD_SESSION = re.compile(r"^/v1\.0/users/([^/]+)/messages/([^/]+)/attachments/createUploadSession$")
+UPLOAD = re.compile(r"^/_upload/([^/]+)$")
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class GraphStubState:
+    """Behaviour knobs and the messages accepted so far."""
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, throttle_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.throttle_rate = throttle_rate
+        self.lock = threading.Lock()
+        self.sent = []
+        self.drafts = {}
+        self.uploads = {}
+
+
+class GraphStubHandler(BaseHTTPRequestHandler):
+    state: GraphStubState = None
+
+    def log_message(self, format, *args):
+        pass  # keep load tests quiet
+
+    def _reply(self, status: int, payload=None, headers=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _simulate(self) -> bool:
+        """Apply latency / throttling / failures. Returns False if a reply was already sent."""
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._reply(401, {"error": {"code": "InvalidAuthenticationToken"}})
+            return False
+        roll = random.random()
+        if roll < self.state.throttle_rate:
+            self._reply(429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": "1"})
+            return False
+        if roll < self.state.throttle_rate + self.state.fail_rate:
+            self._reply(503, {"error": {"code": "ServiceUnavailable"}})
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path == "/_stub/sent":
+            with self.state.lock:
+                self._reply(200, {"count": len(self.state.sent), "messages": self.state.sent})
+            return
+        self._reply(404, {"error": {"code": "NotFound"}})
+
+    def do_DELETE(self):
+        if self.path == "/_stub/sent":
+            with self.state.lock:
+                self.state.sent.clear()
+            self._reply(204)
+            return
+        match = MESSAGE.match(self.path)
+        if match:
+            with self.state.lock:
+                self.state.drafts.pop(match.group(2), None)
+            self._reply(204)
+            return
+        self._reply(404, {"error": {"code": "NotFound"}})
+
+    def _record_sent(self, mailbox: str, message: dict, uploaded=()):
+        with self.state.lock:
+            self.state.sent.append({
+                "mailbox": mailbox,
+                "subject": message.get("subject"),
+                "to": [r["emailAddress"]["address"] for r in message.get("toRecipients", [])],
+                "attachments": [
+                    {"name": a.get("name"), "size": len(base64.b64decode(a.get("contentBytes", "")))}
+                    for a in message.get("attachments", [])
+                ] + list(uploaded),
+            })
+
+    def do_POST(self):
+        match = SEND_MAIL.match(self.path)
+        if match:
+            payload = self._read_json()
+            if self._simulate():
+                self._record_sent(match.group(1), payload.get("message", {}))
+                self._reply(202)
+            return
+
+        match = MESSAGES.match(self.path)
+        if match:
+            payload = self._read_json()
+            if self._simulate():
+                draft_id = uuid.uuid4().hex
+                with self.state.lock:
+                    self.state.drafts[draft_id] = {"message": payload, "uploaded": []}
+                self._reply(201, {"id": draft_id})
+            return
+
+        match = UPLOAD_SESSION.match(self.path)
+        if match:
+            item = self._read_json().get("AttachmentItem", {})
+            if not self._simulate():
+                return
+            if match.group(2) not in self.state.drafts:
+                self._reply(404, {"error": {"code": "ErrorItemNotFound"}})
+                return
+            session_id = uuid.uuid4().hex
+            with self.state.lock:
+                self.state.uploads[session_id] = {
+                    "draft_id": match.group(2), "name": item.get("name"),
+                    "size": int(item.get("size", 0)), "received": 0,
+                }
+            host, port = self.server.server_address[:2]
+            self._reply(201, {"uploadUrl": f"http://{host}:{port}/_upload/{session_id}"})
+            return
+
+        match = SEND_DRAFT.match(self.path)
+        if match:
+            self._read_json()
+            if not self._simulate():
+                return
+            with self.state.lock:
+                draft = self.state.drafts.pop(match.group(2), None)
+            if draft is None:
+                self._reply(404, {"error": {"code": "ErrorItemNotFound"}})
+                return
+            self._record_sent(match.group(1), draft["message"], draft["uploaded"])
+            self._reply(202)
+            return
+
+        self._reply(404, {"error": {"code": "NotFound"}})
+
+    def do_PUT(self):
+        match = UPLOAD.match(self.path)
+        if not match or match.group(1) not in self.state.uploads:
+            self._reply(404, {"error": {"code": "NotFound"}})
+            return
+        if "Authorization" in self.headers:
+            # Like Graph: upload URLs are pre-authenticated and reject bearer tokens
+            self._reply(401, {"error": {"code": "InvalidAuthenticationToken"}})
+            return
+        chunk = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        session = self.state.uploads[match.group(1)]
+        bounds = CONTENT_RANGE.match(self.headers.get("Content-Range", ""))
+        if (not bounds or int(bounds.group(1)) != session["received"]
+                or int(bounds.group(2)) - int(bounds.group(1)) + 1 != len(chunk)
+                or int(bounds.group(3)) != session["size"]):
+            self._reply(416, {"error": {"code": "InvalidRange"}})
+            return
+        session["received"] += len(chunk)
+        if session["received"] < session["size"]:
+            self._reply(200, {"nextExpectedRanges": [f"{session['received']}-"]})
+            return
+        with self.state.lock:
+            del self.state.uploads[match.group(1)]
+            self.state.drafts[session["draft_id"]]["uploaded"].append(
+                {"name": session["name"], "size": session["size"]})
+        self._reply(201)
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8025, **knobs) -> ThreadingHTTPServer:
+    """Build a stub server; call serve_forever() (e.g. in a thread) to run it."""
+    handler = type("BoundGraphStubHandler", (GraphStubHandler,), {"state": GraphStubState(**knobs)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Microsoft Graph mail stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every call")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of calls answered 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of calls answered 429")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, latency=args.latency,
+                         fail_rate=args.fail_rate, throttle_rate=args.throttle_rate)
+    print(f"[OK] Graph stub listening on http://{args.host}:{args.port}/v1.0")
+    server.serve_forever()
@@ -0,0 +1,210 @@
+"""
+Rate limiting and concurrency guards for expensive routes.
+
+- RateLimiter: token bucket per client (X-API-Key, else client IP), used as a
+  FastAPI dependency; over-limit calls get 429 with Retry-After.
+- ConcurrencyLimiter: at most `limit` calls of a route run at once, up to
+  `max_queue` wait (FIFO) for a slot, and the rest get 503 with Retry-After
+  instead of piling up. The time spent waiting is returned to the route and
+  recorded in route_queue_seconds. run_in_executor() keeps the slot until the
+  thread finishes, even when the caller stops waiting for it.
+
+Both are per process: with serve.py the effective limits are multiplied by
+the number of workers.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request
+
+from metrics import ROUTE_ACTIVE, ROUTE_QUEUE_SECONDS, ROUTE_QUEUED, ROUTE_REJECTED
+
+API_KEY_HEADER = "x-api-key"
+
+
+def client_key(request: Request) -> str:
+    """Identify the caller: API key if sent, else the client address.
+
+    Behind a reverse proxy set RATE_LIMIT_TRUST_PROXY=1 to use the first
+    X-Forwarded-For address instead of the proxy's.
+    """
+    api_key = request.headers.get(API_KEY_HEADER)
+    if api_key:
+        return f"key:{api_key}"
+    if os.environ.get("RATE_LIMIT_TRUST_PROXY") == "1":
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else '-'}"
+
+
+class RateLimiter:
+    """Token bucket per client: `rate_per_minute` sustained, bursts up to `burst`."""
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int, max_clients: int = 10000):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, updated), least recently seen first
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client: str) -> float:
+        """Take a token for client. Returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            # Forget the least recently seen clients (they would have a full bucket by now anyway)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __call__(self, request: Request):
+        """FastAPI dependency."""
+        if not self.enabled:
+            return
+        wait = self.check(client_key(request))
+        if wait:
+            ROUTE_REJECTED.labels(self.name, "rate_limited").inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded, retry later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+
+class ConcurrencyLimiter:
+    """Bounded concurrency with a bounded FIFO wait queue.
+
+    Implemented with per-waiter futures rather than asyncio.Semaphore so one
+    instance can be created at import time and used from any event loop.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one slot for the duration of the block; yields the seconds spent queued."""
+        queued = await self._acquire()
+        try:
+            yield queued
+        finally:
+            self._release_active()
+
+    async def run_in_executor(self, executor, func: Callable, *args, timeout: float):
+        """Run func(*args) in executor within a slot; returns (result, seconds queued).
+
+        The slot is released when the thread finishes, not when the caller stops
+        waiting: after a timeout (asyncio.TimeoutError) or a disconnect the thread
+        keeps running, and must keep counting against the limit.
+        """
+        queued = await self._acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BaseException:
+            self._release_active()
+            raise
+        future.add_done_callback(self._on_executor_done)
+        # shield: a timeout cancels our wait, not the future whose callback frees the slot
+        return await asyncio.wait_for(asyncio.shield(future), timeout), queued
+
+    def _on_executor_done(self, future: asyncio.Future):
+        if not future.cancelled():
+            future.exception()  # retrieved, so an abandoned failure isn't logged as unhandled
+        self._release_active()
+
+    async def _acquire(self) -> float:
+        start = time.perf_counter()
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+        else:
+            await self._wait()  # returns with a slot reserved for us by _release
+        ROUTE_ACTIVE.labels(self.name).inc()
+        queued = time.perf_counter() - start
+        ROUTE_QUEUE_SECONDS.labels(self.name).observe(queued)
+        return queued
+
+    def _release_active(self):
+        ROUTE_ACTIVE.labels(self.name).dec()
+        self._release()
+
+    async def _wait(self):
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ROUTE_QUEUED.labels(self.name).inc()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._reject("queue_timeout")
+            # Handed a slot just as the timeout fired: keep it
+        except asyncio.CancelledError:
+            # Client went away; give back the slot if one was already handed to us
+            if waiter.done():
+                self._release()
+            raise
+        finally:
+            ROUTE_QUEUED.labels(self.name).dec()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _release(self):
+        """Free a slot, handing it directly to the oldest waiter so newcomers can't jump the queue."""
+        self.active -= 1
+        while self._waiters and self.active < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def _reject(self, reason: str):
+        ROUTE_REJECTED.labels(self.name, reason).inc()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server busy ({self.active} running, {self.waiting} queued), retry later",
+            headers={"Retry-After": str(max(1, math.ceil(self.queue_timeout / 4)))},
+        )
+
+
+def env_rate_limiter(name: str, prefix: str, rate_per_minute: float, burst: int) -> RateLimiter:
+    """RateLimiter configured from <PREFIX>_RATE_PER_MINUTE / <PREFIX>_RATE_BURST (0 disables)."""
+    return RateLimiter(
+        name,
+        float(os.environ.get(f"{prefix}_RATE_PER_MINUTE", rate_per_minute)),
+        int(os.environ.get(f"{prefix}_RATE_BURST", burst)),
+    )
+
+
+def default_extraction_workers(cpu_count: Optional[int] = None) -> int:
+    """spaCy holds the GIL for most of an extraction, so more than a few threads only adds contention."""
+    return max(1, min(4, cpu_count or os.cpu_count() or 1))
@@ -0,0 +1,504 @@
+"""
+Load tests for the FuturScam API.
+
+Starts the API against mongomock (in the server process) or a local mongod, with
+graph_stub.py standing in for Microsoft Graph, then runs each scenario at each
+concurrency level for a fixed duration. Clients are closed-loop: each of the N
+clients sends its next request as soon as the previous one is answered.
+
+Scenarios:
+- mongodb / staging: POST, GET, PATCH (with If-Match), DELETE of a job
+- users:             POST, GET, PUT, DELETE of a user
+- skillboy:          POST /skillboy with a distinct RFP text each time (no cache hits)
+- mail:              POST /mail with a small attachment; with the local Graph stub, also
+                     how fast the outbox delivers what was accepted (waits for the drain)
+
+Results (throughput, p50/p95/p99 latency, errors) are appended to an NDJSON file.
+Each result is compared with the median of the previous runs with the same setup; the
+exit code is 1 when throughput drops or p95 latency rises by more than --threshold,
+or when the error rate exceeds --max-error-rate.
+
+    python loadtest.py                                          # mongomock, every scenario
+    python loadtest.py --mongo mongodb://localhost:27017 --workers 4
+    python loadtest.py --scenario skillboy --concurrency 1,4,16 --duration 20
+    python loadtest.py --target http://127.0.0.1:8000 --scenario mongodb   # already running server
+
+The local server runs with rate limits disabled, including the outbox's send rate. Against a local mongod it uses (and
+first drops) the `futurscam_loadtest` database.
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+
+import requests
+
+LOADTEST_DB = "futurscam_loadtest"
+DEFAULT_RESULTS = "loadtest_results.ndjson"
+
+SENTENCES = [
+    "We are looking for a senior Python developer with Django and PostgreSQL experience.",
+    "The data engineer will build pipelines with Spark, Kafka and Airflow on AWS.",
+    "Experience with Docker, Kubernetes and Terraform is required.",
+    "Strong knowledge of Java, Spring Boot and REST APIs.",
+    "The consultant designs data models in Snowflake and dbt.",
+    "Frontend work in React and TypeScript, with a Node.js backend.",
+    "Security background: SIEM, penetration testing and network security.",
+    "Azure DevOps CI/CD pipelines and infrastructure as code.",
+    "Fluent French and English, Dutch is a plus.",
+    "Agile team working in Scrum with two-week sprints.",
+    "Machine learning with PyTorch, scikit-learn and pandas.",
+    "Mission in Brussels, two days on site, start as soon as possible.",
+]
+
+
+# ==========================================================
+# Scenarios
+# ==========================================================
+class Client:
+    """requests.Session that records (operation, status, seconds) for every call."""
+
+    def __init__(self, base_url: str, timeout: float):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.records = []
+        self.recording = False
+        self.accepted = 0  # mails accepted by POST /mail, warmup included
+
+    def call(self, operation: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        if self.recording:
+            self.records.append((operation, status, time.perf_counter() - start))
+        return response
+
+
+def _job(job_id: str, rng: random.Random) -> dict:
+    return {
+        "company": {"city": rng.choice(["Brussels", "Gent", "Antwerp", "Liège"]), "name": "LoadTest"},
+        "conditions": {"fromAt": "2026-01-01", "toAt": "2026-12-31", "dailyRate": {"min": 500, "max": 700}},
+        "deadlineAt": "2026-12-01",
+        "publishedAt": "2026-10-01",
+        "job_id": job_id,
+        # Distinct text, so staging ingest doesn't flag the jobs as duplicates of each other
+        "job_desc": " ".join(rng.sample(SENTENCES, 4)) + f" Reference {job_id}.",
+        "roleTitle": "Load test engineer",
+        "skills": [{"name": "Python", "seniority": "Senior"}],
+    }
+
+
+def _job_crud(prefix: str):
+    def scenario(client: Client, rng: random.Random):
+        job_id = f"lt-{uuid.uuid4().hex[:12]}"
+        client.call(f"POST {prefix}", "post", prefix, json=_job(job_id, rng))
+        response = client.call(f"GET {prefix}/{{id}}", "get", f"{prefix}/{job_id}")
+        etag = response.headers.get("ETag", "*") if response is not None else "*"
+        client.call(f"PATCH {prefix}/{{id}}", "patch", f"{prefix}/{job_id}",
+                    json={"conditions": {"dailyRate": {"max": 750}}, "add_skills": [{"name": "Docker"}]},
+                    headers={"If-Match": etag})
+        client.call(f"DELETE {prefix}/{{id}}", "delete", f"{prefix}/{job_id}")
+    return scenario
+
+
+def scenario_users(client: Client, rng: random.Random):
+    user_id = f"lt-{uuid.uuid4().hex[:12]}"
+    client.call("POST /users", "post", "/users", json={
+        "company": "LoadTest", "mail": f"{user_id}@example.com", "name": "Load Test",
+        "role": "user", "metadata": [], "password": "loadtest", "id": user_id,
+    })
+    client.call("GET /users/{id}", "get", f"/users/{user_id}")
+    client.call("PUT /users/{id}", "put", f"/users/{user_id}", json={"role": "admin"})
+    client.call("DELETE /users/{id}", "delete", f"/users/{user_id}")
+
+
+def scenario_skillboy(client: Client, rng: random.Random):
+    text = " ".join(rng.sample(SENTENCES, 5)) + f" Ref {uuid.uuid4().hex[:8]}."
+    client.call("POST /skillboy", "post", "/skillboy", json={"text": text})
+
+
+def scenario_mail(client: Client, rng: random.Random):
+    response = client.call("POST /mail", "post", "/mail", data={
+        "to_addresses": "loadtest@example.com",
+        # Unique, so the stub's count of distinct subjects ignores duplicate sends
+        "subject": f"Load test {uuid.uuid4().hex[:12]}",
+        "body": "<p>" + rng.choice(SENTENCES) + "</p>",
+    }, files=[("attachments", ("rfp.txt", b"x" * 2048, "text/plain"))])
+    if response is not None and response.status_code == 202:
+        client.accepted += 1
+
+
+SCENARIOS = {
+    "mongodb": _job_crud("/mongodb"),
+    "staging": _job_crud("/staging"),
+    "users": scenario_users,
+    "skillboy": scenario_skillboy,
+    "mail": scenario_mail,
+}
+
+
+# ==========================================================
+# Measurement
+# ==========================================================
+def percentile(sorted_values, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(records, seconds: float) -> dict:
+    latencies = sorted(elapsed for _, _, elapsed in records)
+    errors = sum(1 for _, status, _ in records if not 200 <= status < 300)
+    return {
+        "requests": len(records),
+        "rps": round(len(records) / seconds, 1),
+        "errors": errors,
+        "error_rate": round(errors / len(records), 4) if records else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def run_level(base_url: str, name: str, concurrency: int, duration: float, warmup: float, timeout: float,
+              delivered: Optional[Callable[[], Tuple[int, int]]] = None, drain_timeout: float = 120.0) -> dict:
+    """Run one scenario with `concurrency` clients; only calls started after the warmup count.
+
+    For mail, `delivered` (distinct messages and sends received by the Graph stub so far)
+    is used to wait until the outbox has sent everything accepted, and to measure its
+    delivery rate.
+    """
+    scenario = SCENARIOS[name]
+    clients = [Client(base_url, timeout) for _ in range(concurrency)]
+    distinct_before, sends_before = delivered() if delivered else (0, 0)
+    start = time.monotonic()
+    measure_from, end = start + warmup, start + warmup + duration
+
+    def loop(client: Client, seed: int):
+        rng = random.Random(seed)
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                return
+            client.recording = now >= measure_from
+            scenario(client, rng)
+
+    threads = [threading.Thread(target=loop, args=(client, i), daemon=True) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Iterations that started before `end` may finish after it: measure the real window
+    load_end = time.monotonic()
+    seconds = max(load_end - measure_from, 1e-9)
+
+    records = [record for client in clients for record in client.records]
+    result = {"scenario": name, "concurrency": concurrency, **summarize(records, seconds)}
+    by_operation = {}
+    for record in records:
+        by_operation.setdefault(record[0], []).append(record)
+    result["operations"] = {op: summarize(recs, seconds) for op, recs in sorted(by_operation.items())}
+    result["statuses"] = {}
+    for _, status, _ in records:
+        result["statuses"][str(status)] = result["statuses"].get(str(status), 0) + 1
+
+    accepted = sum(client.accepted for client in clients)
+    if delivered and accepted:
+        while delivered()[0] - distinct_before < accepted and time.monotonic() - load_end < drain_timeout:
+            time.sleep(0.05)
+        done = time.monotonic()
+        distinct, sends = delivered()
+        result["delivery"] = {
+            "accepted": accepted,
+            "delivered": distinct - distinct_before,
+            "duplicates": (sends - sends_before) - (distinct - distinct_before),
+            # From the first POST to the last message received by the stub
+            "mps": round(accepted / (done - start), 1),
+            "drain_seconds": round(done - load_end, 2),
+        }
+    return result
+
+
+# ==========================================================
+# History and regressions
+# ==========================================================
+def load_history(path: str, setup: dict) -> list:
+    """Previous runs with the same setup, oldest first."""
+    if not os.path.exists(path):
+        return []
+    runs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                run = json.loads(line)
+                if run.get("setup") == setup:
+                    runs.append(run)
+    return runs
+
+
+def compare(result: dict, history: list, runs: int, threshold: float, max_error_rate: float) -> list:
+    """Problems with one result: errors, or a regression against the median of the last `runs` runs."""
+    problems = []
+    if result["error_rate"] > max_error_rate:
+        problems.append(f"error rate {result['error_rate']:.2%} > {max_error_rate:.2%} ({result['statuses']})")
+    delivery = result.get("delivery")
+    if delivery and delivery["delivered"] < delivery["accepted"]:
+        problems.append(f"only {delivery['delivered']}/{delivery['accepted']} mails delivered within the drain timeout")
+    if delivery and delivery["duplicates"]:
+        problems.append(f"{delivery['duplicates']} mails sent more than once")
+    previous = [
+        r for run in history[-runs:] for r in run["results"]
+        if (r["scenario"], r["concurrency"]) == (result["scenario"], result["concurrency"])
+    ]
+    if not previous:
+        return problems
+    rps = round(statistics.median(r["rps"] for r in previous), 1)
+    p95 = round(statistics.median(r["p95_ms"] for r in previous), 1)
+    result["baseline"] = {"runs": len(previous), "rps": rps, "p95_ms": p95}
+    if rps and result["rps"] < rps * (1 - threshold):
+        problems.append(f"throughput {result['rps']} req/s vs {rps} ({result['rps'] / rps - 1:+.0%})")
+    if p95 and result["p95_ms"] > p95 * (1 + threshold):
+        problems.append(f"p95 {result['p95_ms']} ms vs {p95} ({result['p95_ms'] / p95 - 1:+.0%})")
+    previous_delivery = [r["delivery"]["mps"] for r in previous if r.get("delivery")]
+    if delivery and previous_delivery:
+        mps = round(statistics.median(previous_delivery), 1)
+        result["baseline"]["delivery_mps"] = mps
+        if mps and delivery["mps"] < mps * (1 - threshold):
+            problems.append(f"mail delivery {delivery['mps']} msg/s vs {mps} ({delivery['mps'] / mps - 1:+.0%})")
+    return problems
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+# ==========================================================
+# Local server
+# ==========================================================
+def serve_app(args):
+    """Run the API in this process (child of the load test) against the chosen MongoDB."""
+    import types
+
+    try:
+        import params
+    except ImportError:
+        params = types.ModuleType("params")
+        sys.modules["params"] = params
+    for name, value in (("COLLECTION_NAME", "RFP"), ("AZURE_CLIENT", ""), ("AZURE_URI", ""), ("AZURE_SECRET", "")):
+        if not hasattr(params, name):
+            setattr(params, name, value)
+    # Never the real database or mailbox
+    params.DB_NAME = LOADTEST_DB
+    params.AZURE_MAILBOX = "loadtest@example.com"
+
+    if args.mongo == "mongomock":
+        import mongomock
+        import mongomock.gridfs
+        import pymongo
+
+        mongomock.gridfs.enable_gridfs_integration()
+        client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *a, **k: client
+        params.MONGO_URI = "mongodb://mongomock"
+    else:
+        from pymongo import MongoClient
+
+        params.MONGO_URI = args.mongo
+        MongoClient(args.mongo).drop_database(LOADTEST_DB)
+
+    if args.workers > 1:
+        import serve
+        serve.main(["--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(args.port),
+                    "--log-level", "warning"])
+    else:
+        import uvicorn
+        import main
+        uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def stub_deliveries(state) -> Tuple[int, int]:
+    """(distinct messages, sends) received by the Graph stub."""
+    with state.lock:
+        subjects = [message["subject"] for message in state.sent]
+    return len(set(subjects)), len(subjects)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, graph_url: str):
+    """Start the API as a subprocess and wait until it and its skill extractor are ready."""
+    port = _free_port()
+    env = dict(
+        os.environ,
+        GRAPH_URL=graph_url,
+        GRAPH_STATIC_TOKEN="loadtest",
+        SKILLBOY_RATE_PER_MINUTE="0",
+        MAIL_API_RATE_PER_MINUTE="0",
+        MAIL_RATE_PER_MINUTE="0",  # outbox sends: 0 is no limit
+    )
+    if args.mongo == "mongomock":
+        # mongomock's find_one_and_update isn't atomic across threads: concurrent outbox
+        # workers would claim (and send) the same message twice
+        env.setdefault("MAIL_WORKERS", "1")
+    command = [sys.executable, os.path.abspath(__file__), "--serve-app", "--port", str(port),
+               "--mongo", args.mongo, "--workers", str(args.workers)]
+    log = open(args.server_log, "w", encoding="utf-8")
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API exited during startup (status {process.returncode}), see {args.server_log}")
+        try:
+            # /health/ready doesn't wait for the extractor, which /skillboy needs;
+            # /skillboy/health answers 200 while loading, so check its status
+            ready = requests.get(f"{base_url}/health/ready", timeout=1)
+            skillboy = requests.get(f"{base_url}/skillboy/health", timeout=1)
+            if ready.status_code == 200 and skillboy.json().get("status") == "ready":
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"API not ready after {args.startup_timeout}s, see {args.server_log}")
+
+
+# ==========================================================
+# Main
+# ==========================================================
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the FuturScam API")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario(s) to run (default: all)")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per scenario and level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each measurement")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--target", help="URL of a running API instead of starting one")
+    parser.add_argument("--mongo", default="mongomock", help='"mongomock" or a MongoDB URI (e.g. mongodb://localhost:27017)')
+    parser.add_argument("--workers", type=int, default=1, help="API workers (serve.py); needs a real MongoDB when > 1")
+    parser.add_argument("--graph-latency", type=float, default=0.05, help="Seconds the Graph stub takes per call")
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0,
+                        help="Seconds to wait for the outbox to deliver the accepted mails")
+    parser.add_argument("--server-log", default="loadtest_server.log", help="Output of the local API")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="NDJSON file the results are appended to")
+    parser.add_argument("--no-record", dest="record", action="store_false", help="Compare, but don't append the results")
+    parser.add_argument("--baseline-runs", type=int, default=5, help="Previous runs whose median is the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed relative throughput drop / p95 increase (0.2 = 20%%)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--serve-app", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.serve_app:
+        serve_app(args)
+        return 0
+    if args.mongo == "mongomock" and args.workers > 1 and not args.target:
+        sys.exit("mongomock lives in one process: use --workers 1 or a real MongoDB (--mongo mongodb://...)")
+
+    scenarios = args.scenario or list(SCENARIOS)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    setup = {
+        "target": args.target or "local",
+        "mongo": "external" if args.target else ("mongomock" if args.mongo == "mongomock" else "mongod"),
+        "workers": None if args.target else args.workers,
+        "duration": args.duration,
+        "graph_latency": None if args.target else args.graph_latency,
+    }
+
+    process = graph = delivered = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            import graph_stub
+
+            graph = graph_stub.make_server("127.0.0.1", 0, latency=args.graph_latency)
+            threading.Thread(target=graph.serve_forever, daemon=True).start()
+            delivered = functools.partial(stub_deliveries, graph.RequestHandlerClass.state)
+            print("🔄 Starting the API (waiting for the skill extractor)...")
+            process, base_url = start_server(args, f"http://127.0.0.1:{graph.server_address[1]}/v1.0")
+        print(f"[OK] Load testing {base_url}: {', '.join(scenarios)} at concurrency {levels}, "
+              f"{args.duration:g}s each")
+
+        history = load_history(args.results, setup)
+        results, problems = [], []
+        print(f"{'scenario':<10} {'conc':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  vs baseline")
+        for name in scenarios:
+            for level in levels:
+                result = run_level(base_url, name, level, args.duration, args.warmup, args.timeout,
+                                   delivered, args.drain_timeout)
+                found = compare(result, history, args.baseline_runs, args.threshold, args.max_error_rate)
+                baseline = result.get("baseline")
+                versus = (f"{result['rps'] / baseline['rps'] - 1:+.0%} req/s, {result['p95_ms'] / baseline['p95_ms'] - 1:+.0%} p95"
+                          if baseline and baseline["rps"] and baseline["p95_ms"] else "-")
+                print(f"{name:<10} {level:>4} {result['rps']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} "
+                      f"{result['p99_ms']:>8} {result['errors']:>7}  {versus}{'  ⚠️' if found else ''}")
+                if "delivery" in result:
+                    delivery = result["delivery"]
+                    print(f"{'':<10} {'':>4} delivered {delivery['delivered']}/{delivery['accepted']} at "
+                          f"{delivery['mps']} msg/s, drained {delivery['drain_seconds']}s after the load, "
+                          f"{delivery['duplicates']} duplicates")
+                results.append(result)
+                problems.extend(f"{name} @ {level}: {problem}" for problem in found)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        if graph:
+            graph.shutdown()
+
+    if args.record:
+        run = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "host": {"cpus": os.cpu_count(), "python": platform.python_version(), "platform": platform.platform()},
+            "setup": setup,
+            "results": results,
+        }
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"[OK] Results appended to {args.results} ({len(history) + 1} runs with this setup)")
+
+    if problems:
+        print(f"[ERROR] {len(problems)} regression(s) (threshold {args.threshold:.0%}):")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
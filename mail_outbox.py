@@ -0,0 +1,456 @@
+import asyncio
+import html
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from string import Template
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+import gridfs
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from mail_sender import INLINE_LIMIT, EncodedAttachment, MailDeliveryError, MailSender, stream_size
+
+# Message lifecycle: queued -> sending -> sent | failed (queued again between retries)
+STATUS_QUEUED = "queued"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+# Batches whose shared attachments are kept pre-encoded in memory
+ENCODED_CACHE_BATCHES = 8
+
+# Document holding the mailbox-wide send schedule and throttling pause
+RATE_STATE_ID = "mailbox"
+RATE_STATE_RETRIES = 10
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def render_template(template: str, variables: Dict[str, str], escape: bool = False) -> str:
+    """Fill `${name}` placeholders; raises KeyError on a missing variable.
+
+    With escape=True (HTML bodies) the values are HTML-escaped.
+    """
+    if escape:
+        variables = {key: html.escape(str(value)) for key, value in variables.items()}
+    return Template(template).substitute(variables)
+
+
+class MailOutbox:
+    """Persistent outbox for outgoing mail, drained by a pool of async workers.
+
+    Messages are stored in a MongoDB collection and their attachments in GridFS,
+    so a restart does not lose anything that was accepted by `/mail`.
+
+    A claimed message carries its owner (`claimed_by`) and a lease
+    (`lease_expires_at`) renewed while it is being sent. Only messages whose
+    lease expired (their process died) are put back in the queue, so a new
+    serve.py worker or reload generation never resends mail that a live
+    sibling is sending.
+
+    Sends from every worker of every process (serve.py workers, reload
+    generations) follow one schedule stored in MongoDB, so the mailbox gets
+    `rate_per_minute` sends in total, not per process. A 429 from Graph is
+    recorded there too and pauses every sender for its Retry-After delay,
+    since the throttling applies to the mailbox rather than to a single
+    message. The schedule uses wall-clock time: processes on several hosts
+    need synchronized clocks.
+    """
+
+    def __init__(
+        self,
+        db,
+        sender_factory: Callable[[], MailSender],
+        collection_name: str = "MailOutbox",
+        workers: int = 4,
+        max_attempts: int = 5,
+        base_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        poll_interval: float = 5.0,
+        rate_per_minute: float = 30.0,
+        lease_seconds: float = 60.0,
+    ):
+        self.collection = db[collection_name]
+        self.files = gridfs.GridFS(db, collection=f"{collection_name}Files")
+        self.sender_factory = sender_factory
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.state = db[f"{collection_name}State"]
+        self.rate = rate_per_minute / 60.0  # 0: no limit
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.burst = max(1.0, float(workers))
+        self._encoded: "OrderedDict[str, List[EncodedAttachment]]" = OrderedDict()
+        self._encoded_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def enqueue(
+        self,
+        to_addresses: List[str],
+        subject: str,
+        body: str,
+        attachments: Optional[List[Tuple[str, Union[bytes, BinaryIO]]]] = None,
+        cc_addresses: Optional[List[str]] = None,
+        bcc_addresses: Optional[List[str]] = None,
+        is_html: bool = True,
+    ) -> str:
+        """Persist a message and return its id. Blocking (pymongo).
+
+        Attachment streams are copied into GridFS chunk by chunk, so uploads
+        are never held in memory as a whole.
+        """
+        doc = self._new_message(to_addresses, subject, body, self._store_attachments(attachments),
+                                cc_addresses, bcc_addresses, is_html)
+        message_id = str(self.collection.insert_one(doc).inserted_id)
+        self._notify()
+        return message_id
+
+    def enqueue_batch(
+        self,
+        messages: List[dict],
+        attachments: Optional[List[Tuple[str, Union[bytes, BinaryIO]]]] = None,
+        cc_addresses: Optional[List[str]] = None,
+        bcc_addresses: Optional[List[str]] = None,
+        is_html: bool = True,
+    ) -> Tuple[str, List[str]]:
+        """Persist one message per entry of `messages` (dicts with to/subject/body).
+
+        The attachments are stored once and shared by the whole batch. Returns
+        the batch id and the message ids, in the order of `messages`.
+        """
+        batch_id = str(ObjectId())
+        files = self._store_attachments(attachments)
+        docs = [
+            dict(self._new_message([m["to"]], m["subject"], m["body"], files,
+                                   cc_addresses, bcc_addresses, is_html), batch_id=batch_id)
+            for m in messages
+        ]
+        result = self.collection.insert_many(docs)
+        self._notify()
+        return batch_id, [str(inserted_id) for inserted_id in result.inserted_ids]
+
+    def _store_attachments(self, attachments) -> List[dict]:
+        stored = []
+        for name, content in attachments or []:
+            size = len(content) if isinstance(content, bytes) else stream_size(content)
+            stored.append({"name": name, "file_id": self.files.put(content, filename=name), "size": size})
+        return stored
+
+    def _new_message(self, to_addresses, subject, body, attachments, cc_addresses, bcc_addresses, is_html) -> dict:
+        return {
+            "status": STATUS_QUEUED,
+            "batch_id": None,
+            "to": to_addresses,
+            "cc": cc_addresses,
+            "bcc": bcc_addresses,
+            "subject": subject,
+            "body": body,
+            "is_html": is_html,
+            "attachments": attachments,
+            "attempts": 0,
+            "last_error": None,
+            "created_at": _now(),
+            "next_attempt_at": _now(),
+            "sent_at": None,
+        }
+
+    def _notify(self):
+        if self._loop is not None:
+            # enqueue() runs in a worker thread; asyncio.Event is not thread-safe
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def get(self, message_id: str) -> Optional[dict]:
+        """Return the public status of a message, or None if unknown."""
+        doc = self.collection.find_one({"_id": ObjectId(message_id)}, {"body": 0})
+        if not doc:
+            return None
+        return self._public(doc)
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        """Return per-recipient statuses and totals for a batch, or None if unknown."""
+        docs = list(self.collection.find({"batch_id": batch_id}, {"body": 0}).sort("_id", 1))
+        if not docs:
+            return None
+        totals = {status: 0 for status in (STATUS_QUEUED, STATUS_SENDING, STATUS_SENT, STATUS_FAILED)}
+        for doc in docs:
+            totals[doc["status"]] += 1
+        return {
+            "batch_id": batch_id,
+            "count": len(docs),
+            "totals": totals,
+            "done": totals[STATUS_QUEUED] + totals[STATUS_SENDING] == 0,
+            "results": [
+                {"to": doc["to"][0], "id": str(doc["_id"]), "status": doc["status"],
+                 "attempts": doc["attempts"], "last_error": doc["last_error"]}
+                for doc in docs
+            ],
+        }
+
+    def _public(self, doc: dict) -> dict:
+        return {
+            "id": str(doc["_id"]),
+            "batch_id": doc.get("batch_id"),
+            "status": doc["status"],
+            "attempts": doc["attempts"],
+            "last_error": doc["last_error"],
+            "recipients": {"to": doc["to"], "cc": doc["cc"], "bcc": doc["bcc"]},
+            "attachments_count": len(doc["attachments"]),
+            "created_at": doc["created_at"].isoformat(),
+            "sent_at": doc["sent_at"].isoformat() if doc["sent_at"] else None,
+        }
+
+    # ------------------------------------------------------------------
+    # Worker pool
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """Start the worker pool on the running event loop."""
+        # Messages left in "sending" by a crashed process are picked up again
+        await asyncio.to_thread(self._create_indexes)
+        await asyncio.to_thread(self._recover)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recovery_loop()))
+        print(f"[OK] Mail outbox started with {self.workers} workers")
+
+    def _create_indexes(self):
+        self.collection.create_index([("status", 1), ("next_attempt_at", 1)])
+        self.collection.create_index("batch_id")
+
+    def _recover(self) -> int:
+        """Requeue messages whose sender's lease expired. Messages without a lease predate leases."""
+        result = self.collection.update_many(
+            {"status": STATUS_SENDING, "$or": [
+                {"lease_expires_at": {"$lt": _now()}},
+                {"lease_expires_at": {"$exists": False}},
+            ]},
+            {"$set": {"status": STATUS_QUEUED, "claimed_by": None}},
+        )
+        if result.modified_count:
+            print(f"[WARN] Requeued {result.modified_count} mail(s) whose sender stopped")
+        return result.modified_count
+
+    async def _recovery_loop(self):
+        # A crashed sibling's leases expire after start() ran: check again every lease
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            try:
+                if await asyncio.to_thread(self._recover):
+                    self._wakeup.set()
+            except Exception as e:
+                print(f"[ERROR] Mail outbox recovery failed: {e}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _claim(self) -> Optional[dict]:
+        return self.collection.find_one_and_update(
+            {"status": STATUS_QUEUED, "next_attempt_at": {"$lte": _now()}},
+            {"$set": {"status": STATUS_SENDING, "claimed_by": self.owner, "lease_expires_at": self._lease_end()},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _lease_end(self) -> datetime:
+        return _now() + timedelta(seconds=self.lease_seconds)
+
+    async def _renew_lease(self, message_id: ObjectId):
+        """Extend the lease of a message being sent until cancelled."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(
+                    self.collection.update_one,
+                    {"_id": message_id, "status": STATUS_SENDING, "claimed_by": self.owner},
+                    {"$set": {"lease_expires_at": self._lease_end()}},
+                )
+            except Exception as e:
+                print(f"[WARN] Could not renew the lease of mail {message_id}: {e}")
+
+    def _reserve_send_slot(self) -> float:
+        """Book the next send in the mailbox-wide schedule; returns the seconds to wait for it.
+
+        GCRA: `next_slot_at` is when the next send is due. It may lag behind now by
+        up to burst - 1 intervals, which allows a burst after an idle period.
+        """
+        for _ in range(RATE_STATE_RETRIES):
+            now = time.time()
+            state = self.state.find_one({"_id": RATE_STATE_ID}) or {}
+            slot = max(now, state.get("paused_until") or 0)
+            if self.rate <= 0:
+                return slot - now
+            interval = 1 / self.rate
+            slot = max(slot - (self.burst - 1) * interval, state.get("next_slot_at") or 0, state.get("paused_until") or 0)
+            try:
+                # Compare-and-set, so two senders never book the same slot
+                result = self.state.update_one(
+                    {"_id": RATE_STATE_ID, "next_slot_at": state.get("next_slot_at")},
+                    {"$set": {"next_slot_at": slot + interval}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                return max(0.0, slot - now)
+        # Heavy contention: don't book, but don't send faster than the rate either
+        return 1 / self.rate
+
+    def _pause_left(self) -> float:
+        state = self.state.find_one({"_id": RATE_STATE_ID}, {"paused_until": 1}) or {}
+        return (state.get("paused_until") or 0) - time.time()
+
+    async def _acquire_send_slot(self):
+        """Wait for our slot in the shared schedule and for any throttling pause to end."""
+        while True:
+            await asyncio.sleep(await asyncio.to_thread(self._reserve_send_slot))
+            # A 429 may have paused the mailbox while we waited: book a slot after the pause
+            if await asyncio.to_thread(self._pause_left) <= 0:
+                return
+
+    async def _worker(self):
+        while True:
+            # Cleared before polling so an enqueue racing with the poll still wakes us
+            self._wakeup.clear()
+            try:
+                doc = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                print(f"[ERROR] Mail outbox poll failed: {e}")
+                doc = None
+
+            if doc is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Slots are booked only for claimed messages, so idle polling doesn't use the budget
+            renew = asyncio.create_task(self._renew_lease(doc["_id"]))
+            try:
+                await self._acquire_send_slot()
+                await asyncio.to_thread(self._process, doc)
+            except Exception as e:
+                # The lease lapses and the message is requeued by recovery
+                print(f"[ERROR] Mail {doc['_id']} not sent: {e}")
+            finally:
+                renew.cancel()
+
+    def _attachments_for(self, doc: dict) -> list:
+        """Attachments to hand to the sender.
+
+        Batch attachments that fit inline are base64-encoded once and reused for
+        every recipient; everything else is streamed from GridFS by the sender.
+        """
+        batch_id = doc.get("batch_id")
+        if batch_id and 0 < sum(a["size"] for a in doc["attachments"]) <= INLINE_LIMIT:
+            with self._encoded_lock:
+                encoded = self._encoded.get(batch_id)
+                if encoded is None:
+                    encoded = [EncodedAttachment(a["name"], self.files.get(a["file_id"])) for a in doc["attachments"]]
+                    self._encoded[batch_id] = encoded
+                    if len(self._encoded) > ENCODED_CACHE_BATCHES:
+                        self._encoded.popitem(last=False)
+                else:
+                    self._encoded.move_to_end(batch_id)
+            return encoded
+        # GridOut streams: the sender reads them chunk by chunk
+        return [(a["name"], self.files.get(a["file_id"])) for a in doc["attachments"]]
+
+    def _process(self, doc: dict):
+        try:
+            sender = self.sender_factory()
+            attachments = self._attachments_for(doc)
+            sender.deliver(
+                to_addresses=doc["to"],
+                subject=doc["subject"],
+                body=doc["body"],
+                attachments=attachments or None,
+                cc_addresses=doc["cc"],
+                bcc_addresses=doc["bcc"],
+                is_html=doc["is_html"],
+            )
+        except Exception as e:
+            self._record_failure(doc, e)
+            return
+
+        self.collection.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"status": STATUS_SENT, "sent_at": _now(), "last_error": None}},
+        )
+        self._release_attachments(doc)
+
+    def _record_failure(self, doc: dict, error: Exception):
+        if isinstance(error, MailDeliveryError) and error.status_code == 429:
+            # Mailbox-wide throttling: hold every worker of every process, not just this message
+            pause = error.retry_after or self.base_backoff
+            self.state.update_one(
+                {"_id": RATE_STATE_ID}, {"$max": {"paused_until": time.time() + pause}}, upsert=True
+            )
+
+        retryable = not isinstance(error, MailDeliveryError) or error.retryable
+        if not retryable or doc["attempts"] >= self.max_attempts:
+            print(f"[ERROR] Mail {doc['_id']} failed after {doc['attempts']} attempts: {error}")
+            self.collection.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {"status": STATUS_FAILED, "last_error": str(error)}},
+            )
+            self._release_attachments(doc)
+            return
+
+        delay = getattr(error, "retry_after", None)
+        if delay is None:
+            # Exponential backoff with jitter so workers don't retry in lockstep
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (doc["attempts"] - 1))
+            delay *= random.uniform(0.5, 1.0)
+        print(f"[WARN] Mail {doc['_id']} attempt {doc['attempts']} failed, retrying in {delay:.1f}s: {error}")
+        self.collection.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {
+                "status": STATUS_QUEUED,
+                "last_error": str(error),
+                "next_attempt_at": _now() + timedelta(seconds=delay),
+            }},
+        )
+
+    def _release_attachments(self, doc: dict):
+        """Delete a finished message's attachments, once no batch sibling still needs them."""
+        batch_id = doc.get("batch_id")
+        if batch_id:
+            # Our own status is already final, so the last sibling to finish sees 0
+            pending = self.collection.count_documents(
+                {"batch_id": batch_id, "status": {"$in": [STATUS_QUEUED, STATUS_SENDING]}}, limit=1
+            )
+            if pending:
+                return
+            with self._encoded_lock:
+                self._encoded.pop(batch_id, None)
+
+        for a in doc["attachments"]:
+            try:
+                self.files.delete(a["file_id"])
+            except Exception as e:
+                print(f"[WARN] Error deleting outbox attachment {a['file_id']}: {e}")
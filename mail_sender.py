@@ -1,25 +1,82 @@
 import os
+import io
 import requests
-from msal import ConfidentialClientApplication
 import base64
-from pathlib import Path
-from typing import List, Optional
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+from metrics import MAIL_SEND_FAILURES, MAIL_SEND_LATENCY
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+# Graph rejects sendMail requests over ~4 MB, so inline attachments are capped
+# at 3 MB in total; anything bigger goes through a draft + upload session.
+INLINE_LIMIT = 3 * 1024 * 1024
+# Upload sessions accept attachments up to 150 MB
+UPLOAD_SESSION_LIMIT = 150 * 1024 * 1024
+# Upload chunks must be multiples of 320 KiB
+UPLOAD_CHUNK_SIZE = 10 * 320 * 1024
+# Read size for incremental base64 encoding (multiple of 3, so chunks concatenate cleanly)
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+
+
+class MailDeliveryError(Exception):
+    """Raised when Microsoft Graph refuses or fails to deliver a message."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Network errors, throttling (429) and server errors (5xx) are worth retrying."""
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+class EncodedAttachment:
+    """An inline attachment base64-encoded once, reusable across many messages."""
+
+    __slots__ = ("name", "size", "payload")
+
+    def __init__(self, name: str, stream: BinaryIO):
+        self.name = name
+        self.size = stream_size(stream)
+        self.payload = encode_attachment(name, stream)
+
+
+# An attachment is a path on disk, an in-memory (filename, bytes) pair, a
+# (filename, binary stream) pair such as an upload's spooled file or a GridFS
+# file, or an EncodedAttachment shared between messages
+Attachment = Union[str, Tuple[str, Union[bytes, BinaryIO]], EncodedAttachment]
 
 
 class MailSender:
     """Send emails with attachments using Microsoft Graph API."""
     
-    def __init__(self, client_id: str, authority: str, client_secret: str, mailbox_email: str, scopes: list):
+    def __init__(self, client_id: str, authority: str, client_secret: str, mailbox_email: str, scopes: list,
+                 graph_url: str = GRAPH_URL, static_token: Optional[str] = None):
         self.client_id = client_id
         self.authority = authority
         self.client_secret = client_secret
         self.mailbox_email = mailbox_email
         self.scopes = scopes
+        self.graph_url = graph_url.rstrip("/")
+        self.static_token = static_token
         self.access_token = None
         self.headers = {}
 
     def authenticate(self):
         """Authenticate using MSAL with client secret (Application permissions)."""
+        if self.static_token:
+            # Pre-issued token (e.g. a local Graph stub), no MSAL round-trip
+            self._set_token(self.static_token)
+            print("[OK] Authentification par jeton statique.")
+            return
+
+        # Imported here: msal is slow to import and only needed for real Graph authentication
+        from msal import ConfidentialClientApplication
         app = ConfidentialClientApplication(
             self.client_id,
             authority=self.authority,
@@ -30,19 +87,22 @@ class MailSender:
         if "access_token" not in result:
             raise RuntimeError(f"Erreur d'authentification: {result.get('error_description')}")
         
-        self.access_token = result["access_token"]
+        self._set_token(result["access_token"])
+        print("[OK] Authentification réussie.")
+
+    def _set_token(self, token: str):
+        self.access_token = token
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json"
         }
-        print("[OK] Authentification réussie.")
 
     def send_email(
         self,
         to_addresses: List[str],
         subject: str,
         body: str,
-        attachments: Optional[List[str]] = None,
+        attachments: Optional[List[Attachment]] = None,
         cc_addresses: Optional[List[str]] = None,
         bcc_addresses: Optional[List[str]] = None,
         is_html: bool = True
@@ -54,7 +114,7 @@ class MailSender:
             to_addresses: List of recipient email addresses
             subject: Email subject
             body: Email body (plain text or HTML)
-            attachments: List of file paths to attach
+            attachments: List of file paths or (filename, bytes) pairs to attach
             cc_addresses: List of CC recipient addresses
             bcc_addresses: List of BCC recipient addresses
             is_html: Whether body is HTML (default True)
@@ -62,99 +122,247 @@ class MailSender:
         Returns:
             True if email sent successfully, False otherwise
         """
-        if not self.access_token:
-            print("[ERROR] Not authenticated. Call authenticate() first.")
-            return False
-        
         try:
-            # Build recipient lists
-            to_recipients = [{"emailAddress": {"address": addr}} for addr in to_addresses]
-            
-            message_data = {
-                "subject": subject,
-                "body": {
-                    "contentType": "HTML" if is_html else "text",
-                    "content": body
-                },
-                "toRecipients": to_recipients
-            }
-            
-            # Add CC recipients if provided
-            if cc_addresses:
-                message_data["ccRecipients"] = [{"emailAddress": {"address": addr}} for addr in cc_addresses]
-            
-            # Add BCC recipients if provided
-            if bcc_addresses:
-                message_data["bccRecipients"] = [{"emailAddress": {"address": addr}} for addr in bcc_addresses]
-            
-            # Handle attachments
-            attachments_list = []
-            if attachments:
-                for attachment_path in attachments:
-                    attachment_data = self._prepare_attachment(attachment_path)
-                    if attachment_data:
-                        attachments_list.append(attachment_data)
-                
-                if attachments_list:
-                    message_data["attachments"] = attachments_list
-            
-            # Send email using the specific mailbox (required for application permissions)
-            # Format: /users/{email}/sendMail instead of /me/sendMail
-            url = f"https://graph.microsoft.com/v1.0/users/{self.mailbox_email}/sendMail"
-            payload = {"message": message_data}
-            
-            response = requests.post(url, json=payload, headers=self.headers, timeout=30)
-            
-            if response.status_code in [200, 202]:
-                print(f"[OK] Email sent successfully to {', '.join(to_addresses)}")
-                return True
-            else:
-                print(f"[ERROR] Failed to send email: status {response.status_code}")
-                print(f"Response: {response.text}")
-                return False
-                
-        except Exception as e:
-            print(f"[ERROR] Error sending email: {e}")
+            self.deliver(
+                to_addresses=to_addresses,
+                subject=subject,
+                body=body,
+                attachments=attachments,
+                cc_addresses=cc_addresses,
+                bcc_addresses=bcc_addresses,
+                is_html=is_html
+            )
+            return True
+        except MailDeliveryError as e:
+            print(f"[ERROR] Failed to send email: {e}")
             return False
 
-    def _prepare_attachment(self, file_path: str) -> Optional[dict]:
+    def deliver(
+        self,
+        to_addresses: List[str],
+        subject: str,
+        body: str,
+        attachments: Optional[List[Attachment]] = None,
+        cc_addresses: Optional[List[str]] = None,
+        bcc_addresses: Optional[List[str]] = None,
+        is_html: bool = True
+    ):
         """
-        Prepare an attachment for the email.
-        
-        Args:
-            file_path: Path to the file to attach
-        
-        Returns:
-            Dictionary with attachment data, or None if file doesn't exist
+        Send an email, raising MailDeliveryError on failure.
+
+        Same arguments as send_email. The raised error carries the Graph status
+        code and Retry-After delay so callers can decide whether to retry.
+
+        Attachments are read incrementally from their streams. When they fit
+        in INLINE_LIMIT they are sent inline with sendMail; otherwise a draft
+        is created, large files are uploaded in chunks through upload sessions
+        and the draft is sent.
         """
+        if not self.access_token:
+            raise MailDeliveryError("Not authenticated. Call authenticate() first.", status_code=401)
+        
+        start = time.perf_counter()
+        mode = "inline"
         try:
-            if not os.path.exists(file_path):
-                print(f"[WARN] Attachment file not found: {file_path}")
-                return None
-            
-            file_size = os.path.getsize(file_path)
-            
-            # Microsoft Graph has a 25MB limit per attachment
-            if file_size > 25 * 1024 * 1024:
-                print(f"[WARN] File {file_path} is too large (> 25MB), skipping")
-                return None
-            
-            # Read and encode file
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
-            # Encode to base64
-            encoded_content = base64.b64encode(file_content).decode('utf-8')
+            mode = self._deliver(to_addresses, subject, body, attachments, cc_addresses, bcc_addresses, is_html)
+        except MailDeliveryError as e:
+            MAIL_SEND_FAILURES.labels(str(e.status_code or "network")).inc()
+            raise
+        finally:
+            MAIL_SEND_LATENCY.labels(mode).observe(time.perf_counter() - start)
+        
+        print(f"[OK] Email sent successfully to {', '.join(to_addresses)}")
+
+    def _deliver(self, to_addresses, subject, body, attachments, cc_addresses, bcc_addresses, is_html) -> str:
+        """Build and send the message; returns "inline" or "upload_session"."""
+        # Build recipient lists
+        to_recipients = [{"emailAddress": {"address": addr}} for addr in to_addresses]
+        
+        message_data = {
+            "subject": subject,
+            "body": {
+                "contentType": "HTML" if is_html else "text",
+                "content": body
+            },
+            "toRecipients": to_recipients
+        }
+        
+        # Add CC recipients if provided
+        if cc_addresses:
+            message_data["ccRecipients"] = [{"emailAddress": {"address": addr}} for addr in cc_addresses]
+        
+        # Add BCC recipients if provided
+        if bcc_addresses:
+            message_data["bccRecipients"] = [{"emailAddress": {"address": addr}} for addr in bcc_addresses]
+        
+        # Pre-encoded attachments always go inline and use up the inline budget first
+        encoded = [a for a in attachments or [] if isinstance(a, EncodedAttachment)]
+        others = [a for a in attachments or [] if not isinstance(a, EncodedAttachment)]
+        
+        with self._open_attachments(others) as opened:
+            inline, large = self._split_attachments(opened, INLINE_LIMIT - sum(a.size for a in encoded))
             
-            # Get filename from path
-            filename = os.path.basename(file_path)
+            if encoded or inline:
+                message_data["attachments"] = [a.payload for a in encoded] + [
+                    encode_attachment(name, stream) for name, stream, _ in inline
+                ]
             
-            return {
-                "@odata.type": "#microsoft.graph.fileAttachment",
-                "name": filename,
-                "contentBytes": encoded_content
-            }
+            if not large:
+                # Send email using the specific mailbox (required for application permissions)
+                # Format: /users/{email}/sendMail instead of /me/sendMail
+                self._request("post", f"/users/{self.mailbox_email}/sendMail", json={"message": message_data})
+                return "inline"
             
-        except Exception as e:
-            print(f"[ERROR] Error preparing attachment {file_path}: {e}")
-            return None
+            self._send_with_upload_sessions(message_data, large)
+            return "upload_session"
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Call Graph, turning network errors and non-2xx replies into MailDeliveryError."""
+        url = path if path.startswith("http") else f"{self.graph_url}{path}"
+        kwargs.setdefault("headers", self.headers)
+        kwargs.setdefault("timeout", 30)
+        try:
+            response = requests.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            raise MailDeliveryError(f"Error sending email: {e}") from e
+
+        if response.status_code // 100 == 2:
+            return response
+
+        retry_after = response.headers.get("Retry-After")
+        raise MailDeliveryError(
+            f"status {response.status_code}: {response.text}",
+            status_code=response.status_code,
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+
+    def _send_with_upload_sessions(self, message_data: dict, large: List[Tuple[str, BinaryIO, int]]):
+        """Create a draft, upload large attachments in chunks, then send the draft."""
+        draft = self._request("post", f"/users/{self.mailbox_email}/messages", json=message_data).json()
+        message_path = f"/users/{self.mailbox_email}/messages/{draft['id']}"
+        try:
+            for name, stream, size in large:
+                self._upload_attachment(message_path, name, stream, size)
+            self._request("post", f"{message_path}/send")
+        except MailDeliveryError as e:
+            # Don't leave half-built drafts behind; a retry starts from scratch
+            try:
+                self._request("delete", message_path)
+            except MailDeliveryError as delete_error:
+                # Keep the original status (it decides the retry), report the leftover draft with it
+                raise MailDeliveryError(
+                    f"{e} (draft {draft['id']} not deleted: {delete_error})",
+                    status_code=e.status_code,
+                    retry_after=e.retry_after
+                ) from e
+            raise
+
+    def _upload_attachment(self, message_path: str, name: str, stream: BinaryIO, size: int):
+        """Upload one attachment through a Graph upload session, one chunk in memory at a time."""
+        session = self._request(
+            "post",
+            f"{message_path}/attachments/createUploadSession",
+            json={"AttachmentItem": {"attachmentType": "file", "name": name, "size": size}}
+        ).json()
+        
+        offset = 0
+        while offset < size:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                raise MailDeliveryError(f"Attachment {name} ended at {offset} of {size} bytes", status_code=400)
+            end = offset + len(chunk) - 1
+            # The upload URL is pre-authenticated: sending the bearer token is rejected
+            self._request(
+                "put",
+                session["uploadUrl"],
+                data=chunk,
+                headers={
+                    "Content-Length": str(len(chunk)),
+                    "Content-Range": f"bytes {offset}-{end}/{size}"
+                },
+                timeout=120
+            )
+            offset = end + 1
+
+    @contextmanager
+    def _open_attachments(self, attachments: List[Attachment]) -> Iterator[List[Tuple[str, BinaryIO, int]]]:
+        """Open every attachment as a (filename, stream, size) triple, closing owned files afterwards."""
+        opened = []
+        owned = []
+        try:
+            for attachment in attachments:
+                if isinstance(attachment, str):
+                    if not os.path.exists(attachment):
+                        raise MailDeliveryError(f"Attachment file not found: {attachment}", status_code=400)
+                    stream = open(attachment, "rb")
+                    owned.append(stream)
+                    name = os.path.basename(attachment)
+                else:
+                    name, content = attachment
+                    stream = io.BytesIO(content) if isinstance(content, bytes) else content
+                    stream.seek(0)
+                opened.append((name, stream, stream_size(stream)))
+            yield opened
+        finally:
+            for stream in owned:
+                stream.close()
+
+    def _split_attachments(self, opened: List[Tuple[str, BinaryIO, int]], budget: int = INLINE_LIMIT):
+        """Split attachments into those sent inline (within budget bytes) and those needing an upload session.
+
+        Raises a non-retryable MailDeliveryError (413) for an attachment over UPLOAD_SESSION_LIMIT:
+        the message is not sent without it.
+        """
+        inline, large = [], []
+        inline_total = 0
+        for name, stream, size in sorted(opened, key=lambda item: item[2]):
+            if size > UPLOAD_SESSION_LIMIT:
+                raise MailDeliveryError(
+                    f"Attachment {name} is {size} bytes, over the {UPLOAD_SESSION_LIMIT // (1024 * 1024)} MB limit",
+                    status_code=413
+                )
+            if inline_total + size <= budget:
+                inline.append((name, stream, size))
+                inline_total += size
+            else:
+                large.append((name, stream, size))
+        return inline, large
+
+
+def stream_size(stream: BinaryIO) -> int:
+    """Size of a seekable stream, leaving it positioned at the start."""
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def encode_attachment(name: str, stream: BinaryIO) -> dict:
+    """
+    Prepare an inline attachment for the email.
+
+    Args:
+        name: Attachment filename
+        stream: Binary stream positioned at the start of the content
+
+    Returns:
+        Dictionary with attachment data, base64-encoded chunk by chunk
+    """
+    encoded = []
+    pending = b""
+    while True:
+        chunk = stream.read(ENCODE_CHUNK_SIZE)
+        if not chunk:
+            break
+        # Only encode whole 3-byte groups so the pieces concatenate without padding
+        data = pending + chunk
+        cut = len(data) - len(data) % 3
+        encoded.append(base64.b64encode(data[:cut]).decode("ascii"))
+        pending = data[cut:]
+    encoded.append(base64.b64encode(pending).decode("ascii"))
+
+    return {
+        "@odata.type": "#microsoft.graph.fileAttachment",
+        "name": name,
+        "contentBytes": "".join(encoded)
+    }
@@ -1,17 +1,32 @@
-from fastapi import FastAPI, HTTPException, File, Form, UploadFile
-from pydantic import BaseModel
-from pymongo import MongoClient
+from fastapi import FastAPI, HTTPException, File, Form, UploadFile, Response, Depends, Query, Header
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, field_validator
+from pymongo import MongoClient, UpdateOne
 from bson.objectid import ObjectId
-from typing import List, Optional
+from typing import List, Literal, Optional
 import json
+import re
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 import os
-import tempfile
+import signal
+from datetime import datetime, timezone
 
 from params import MONGO_URI, DB_NAME, COLLECTION_NAME
-from test import load_skill_terms, create_extractor, extract_skills
-from mail_sender import MailSender
+from skill_engine import SkillEngine, ReloadState, db_fingerprint
+from mail_sender import MailSender, GRAPH_URL, UPLOAD_SESSION_LIMIT, stream_size
+from mail_outbox import MailOutbox, render_template
+from auth import require_admin
+from limits import ConcurrencyLimiter, default_extraction_workers, env_rate_limiter
+import rfp_stats
+from dedup import DuplicateDetector, minhash
+from updates import update_document, etag
+from profiling import ProfilingMiddleware, profiling_enabled, profiles
+from metrics import (
+    PrometheusMiddleware, render_metrics, EXTRACTION_LATENCY, EXTRACTION_TEXT_LENGTH,
+    EXTRACTION_IN_FLIGHT, EXTRACTOR_LOAD_SECONDS, SKILL_DB_RELOADS, SKILL_CACHE_LOOKUPS, STAGING_DUPLICATES
+)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -19,6 +34,10 @@ app = FastAPI(
     description="API for MongoDB management and skill extraction",
     version="1.0.0"
 )
+app.add_middleware(PrometheusMiddleware)
+# Opt-in: without PROFILING_ENABLED=1 the profiler is not installed at all
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
 
 # MongoDB connection
 def get_collection():
@@ -36,19 +55,104 @@ def get_staging_collection():
     db = client[DB_NAME]
     return db["StagingRFP"]
 
-# Load skill extractor once at startup
-skill_terms = None
-extractor = None
+# Load skill extractor in the background after startup (or once in the parent process, see
+# serve.py); every other route is served meanwhile and /skillboy answers 503 until it's ready.
+# The extractor, its DB version and its result cache live together in one SkillEngine
+# that a reload replaces with a single assignment: read `engine` once per request.
+engine: Optional[SkillEngine] = None
+reload_state = ReloadState()
 
-@app.on_event("startup")
-def startup():
-    global skill_terms, extractor
+def load_extractor() -> bool:
+    """Build a SkillEngine from the files on disk and swap it in. Returns True on success."""
+    global engine
+    reload_state.progress.start()
     try:
-        skill_terms = load_skill_terms("skill_db_optimized_20.json")
-        extractor = create_extractor(skill_terms)
-        print("✅ Skill extractor loaded successfully")
+        new_engine = SkillEngine.load(
+            cache_size=int(os.environ.get("SKILL_CACHE_SIZE", "1024")),
+            compact=os.environ.get("SKILL_DB_COMPACT", "0") == "1",
+            progress=reload_state.progress,
+        )
     except Exception as e:
+        reload_state.progress.finish(error=str(e))
         print(f"⚠️ Warning: Could not load skill extractor: {e}")
+        return False
+    reload_state.progress.finish()
+    engine = new_engine
+    EXTRACTOR_LOAD_SECONDS.set(new_engine.load_seconds)
+    print(f"✅ Skill extractor loaded successfully (skill DB {new_engine.version})")
+    return True
+
+def load_extractor_in_background():
+    """Initial load; holds the reload lock so a reload can't run alongside it."""
+    with reload_state.lock:
+        if engine is None:
+            load_extractor()
+    notify_launcher("ready" if engine else "failed")
+
+def reload_skill_db() -> bool:
+    """Rebuild the engine while the current one keeps serving. Returns False if a reload
+    is already running or the new DB failed to load (the old engine stays in place)."""
+    if not reload_state.lock.acquire(blocking=False):
+        return False
+    try:
+        reload_state.reloading = True
+        reload_state.last_attempt_at = datetime.now(timezone.utc)
+        ok = load_extractor()
+        reload_state.last_error = None if ok else "Could not load skill DB, previous version still active"
+        SKILL_DB_RELOADS.labels("success" if ok else "failure").inc()
+        return ok
+    finally:
+        reload_state.reloading = False
+        reload_state.lock.release()
+
+def launcher_pid() -> Optional[int]:
+    """PID of the serve.py parent when running as one of its workers."""
+    pid = os.environ.get("FUTURSCAM_LAUNCHER_PID")
+    return int(pid) if pid and os.getppid() == int(pid) else None
+
+def notify_launcher(status: str):
+    """Tell the serve.py parent whether this worker's extractor is usable, so a rolling
+    reload stops the previous workers only once their replacements can serve /skillboy."""
+    fd = os.environ.get("FUTURSCAM_READY_FD")
+    if not fd or launcher_pid() is None:
+        return
+    try:
+        os.write(int(fd), f"{os.getpid()} {status}\n".encode())
+    except OSError as e:
+        print(f"⚠️ Warning: Could not notify the launcher: {e}")
+
+async def watch_skill_db(interval: float):
+    """Reload when skill_db_optimized_20.json or token_dist.json changes on disk."""
+    fingerprint = db_fingerprint()
+    while True:
+        await asyncio.sleep(interval)
+        current = db_fingerprint()
+        if current != fingerprint:
+            fingerprint = current
+            print("🔄 Skill DB changed on disk, reloading")
+            await asyncio.to_thread(reload_skill_db)
+
+@app.on_event("startup")
+async def startup():
+    # Workers forked by serve.py inherit an engine already built by the parent, or are
+    # replaced by ones that do once it's built. Otherwise build it without blocking
+    # startup: the server accepts requests within a second.
+    preload = os.environ.get("FUTURSCAM_PRELOAD") if launcher_pid() else None
+    if engine is not None:
+        notify_launcher("ready")
+    elif preload == "loading":
+        reload_state.progress.start()
+        reload_state.progress("loading_in_launcher")
+    elif preload == "failed":
+        reload_state.progress.finish(error="Could not load skill extractor in the launcher process")
+        notify_launcher("failed")
+    else:
+        print("🔄 Loading skill extractor in the background")
+        app.state.extractor_load = asyncio.create_task(asyncio.to_thread(load_extractor_in_background))
+    # Under serve.py the parent watches the files and rolls the workers instead
+    interval = float(os.environ.get("SKILL_DB_WATCH_INTERVAL", "0"))
+    if interval > 0 and launcher_pid() is None:
+        app.state.skill_db_watcher = asyncio.create_task(watch_skill_db(interval))
 
 # ========================
 # DATA MODELS
@@ -118,6 +222,43 @@ class JobUpdate(BaseModel):
     skills: Optional[List[Skill]] = None
     languages: Optional[List[Language]] = None
     RFP_type: Optional[str] = None
+    # Array ops on skills, instead of sending the whole list (see updates.py)
+    add_skills: Optional[List[Skill]] = None
+    remove_skills: Optional[List[str]] = None
+
+# PATCH models: every nested field optional, only the fields sent are changed
+class DailyRatePatch(BaseModel):
+    currency: Optional[str] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+class ConditionsPatch(BaseModel):
+    dailyRate: Optional[DailyRatePatch] = None
+    fixedMargin: Optional[float] = None
+    fromAt: Optional[str] = None
+    toAt: Optional[str] = None
+    startImmediately: Optional[bool] = None
+    occupation: Optional[str] = None
+
+class CompanyPatch(BaseModel):
+    city: Optional[str] = None
+    name: Optional[str] = None
+    country: Optional[str] = None
+    street: Optional[str] = None
+    zipcode: Optional[str] = None
+    region: Optional[str] = None
+
+class JobPatch(JobUpdate):
+    company: Optional[CompanyPatch] = None
+    conditions: Optional[ConditionsPatch] = None
+
+def job_update_data(job: JobUpdate) -> dict:
+    """Fields sent in a job update. List items are stored whole, so they keep their defaults."""
+    data = job.model_dump(exclude_unset=True, exclude_none=True)
+    for field in ("skills", "languages", "add_skills"):
+        if field in data:
+            data[field] = [item.model_dump() for item in getattr(job, field)]
+    return data
 
 class SkillExtractionRequest(BaseModel):
     text: str
@@ -137,9 +278,24 @@ class User(BaseModel):
     password: str
     id: str
 
+# Deliberately loose (Graph does the real check): one @, a dot in the domain, no blanks or separators
+EMAIL_ADDRESS = re.compile(r"^[^@\s,;<>]+@[^@\s,;<>]+\.[^@\s,;<>]+$")
+
+class BulkRecipient(BaseModel):
+    to: str
+    variables: dict = {}
+
+    @field_validator("to")
+    @classmethod
+    def check_address(cls, value: str) -> str:
+        value = value.strip()
+        if not EMAIL_ADDRESS.match(value):
+            raise ValueError(f"invalid email address {value!r}")
+        return value
+
 class UserUpdate(BaseModel):
     company: Optional[str] = None
-    mail: Optional[str]
+    mail: Optional[str] = None
     name: Optional[str] = None
     role: Optional[str] = None
     metadata: Optional[List[dict]] = None
@@ -162,8 +318,85 @@ def get_all_jobs():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Aggregations run in MongoDB; results are cached for STATS_CACHE_TTL seconds and
+# dropped on every write below. The cache is per process, so writes served by another
+# worker (or backfill.py) can take up to the TTL to show. Declared before
+# /mongodb/{job_id} so "stats" isn't a job_id.
+stats_cache = rfp_stats.StatsCache(ttl=float(os.environ.get("STATS_CACHE_TTL", "30")))
+
+@app.on_event("startup")
+async def ensure_stats_indexes():
+    """Create the indexes used by the /mongodb/stats pipelines (no-op if present)"""
+    try:
+        await asyncio.to_thread(get_collection().create_indexes, rfp_stats.STATS_INDEXES)
+    except Exception as e:
+        print(f"⚠️ Warning: Could not create stats indexes: {e}")
+
+def cached_stats(response: Response, key: tuple, compute):
+    """Return compute() through the stats cache, with an X-Cache header"""
+    try:
+        result, hit = stats_cache.get_or_compute(key, compute)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    response.headers["X-Cache"] = "hit" if hit else "miss"
+    return result
+
+def cached_aggregate(response: Response, key: tuple, pipeline: list) -> list:
+    """Run an aggregation on the RFP collection through the stats cache"""
+    return cached_stats(response, key, lambda: list(get_collection().aggregate(pipeline, allowDiskUse=True)))
+
+@app.get("/mongodb/stats")
+def get_stats_overview(response: Response):
+    """Totals, top skills and cities, seniority, daily rates and deadlines of active RFPs"""
+    today = rfp_stats.today()
+
+    def compute():
+        collection = get_collection()
+        [overview] = collection.aggregate(rfp_stats.overview_pipeline(today), allowDiskUse=True)
+        # Counted apart so the pipeline can start with the indexed isActive $match
+        overview["totals"] = {
+            "total": collection.count_documents({}),
+            "active": collection.count_documents({"isActive": True}),
+        }
+        return overview
+
+    overview = cached_stats(response, ("overview", today), compute)
+    return {**overview, "deadlines": rfp_stats.label_deadline_buckets(overview["deadlines"], today)}
+
+@app.get("/mongodb/stats/skills")
+def get_skill_stats(response: Response, active: Optional[bool] = None, limit: int = Query(50, ge=1, le=500)):
+    """Number of RFPs mentioning each skill, most frequent first"""
+    data = cached_aggregate(response, ("skills", active, limit), rfp_stats.skills_pipeline(active, limit))
+    return {"count": len(data), "data": data}
+
+@app.get("/mongodb/stats/counts/{field}")
+def get_count_stats(field: str, response: Response, active: Optional[bool] = None,
+                    limit: int = Query(50, ge=1, le=500)):
+    """Number of RFPs per city, country, region, company, seniority, remote, type or provider"""
+    if field not in rfp_stats.COUNT_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field '{field}', expected one of: {', '.join(rfp_stats.COUNT_FIELDS)}"
+        )
+    data = cached_aggregate(response, ("counts", field, active, limit),
+                            rfp_stats.counts_pipeline(field, active, limit))
+    return {"field": field, "count": len(data), "data": data}
+
+@app.get("/mongodb/stats/daily-rates")
+def get_daily_rate_stats(response: Response, active: Optional[bool] = None):
+    """Daily rate min/max/average per currency, and RFPs per minimum-rate range"""
+    [rates] = cached_aggregate(response, ("daily_rates", active), rfp_stats.daily_rates_pipeline(active))
+    return rates
+
+@app.get("/mongodb/stats/deadlines")
+def get_deadline_stats(response: Response, active: Optional[bool] = None):
+    """RFPs per number of days left until their deadline"""
+    today = rfp_stats.today()
+    data = cached_aggregate(response, ("deadlines", active, today), rfp_stats.deadlines_pipeline(active, today))
+    return {"data": rfp_stats.label_deadline_buckets(data, today)}
+
 @app.get("/mongodb/{job_id}")
-def get_job(job_id: str):
+def get_job(job_id: str, response: Response):
     """Get a specific job document by job_id"""
     try:
         collection = get_collection()
@@ -171,7 +404,10 @@ def get_job(job_id: str):
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
         doc["_id"] = str(doc["_id"])
+        response.headers["ETag"] = etag(doc)
         return doc
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -182,6 +418,7 @@ def create_job(job: JobDocument):
         collection = get_collection()
         doc = job.model_dump()
         result = collection.insert_one(doc)
+        stats_cache.invalidate()
         return {
             "message": "Job posted successfully",
             "id": str(result.inserted_id)
@@ -190,30 +427,30 @@ def create_job(job: JobDocument):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/mongodb/{job_id}")
-def update_job(job_id: str, job: JobUpdate):
-    """Update an existing job document by job_id"""
+def update_job(job_id: str, job: JobUpdate, response: Response, if_match: Optional[str] = Header(None)):
+    """Update an existing job document by job_id (nested objects are merged, not replaced)"""
     try:
-        collection = get_collection()
-        update_data = job.model_dump(exclude_unset=True, exclude_none=True)
-        
-        if not update_data:
-            raise HTTPException(status_code=400, detail="No fields to update")
-        
-        result = collection.update_one(
-            {"job_id": job_id},
-            {"$set": update_data}
-        )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Document not found")
+        doc, modified = update_document(get_collection(), {"job_id": job_id}, job_update_data(job), if_match)
+        if modified:
+            stats_cache.invalidate()
+        doc["_id"] = str(doc["_id"])
+        response.headers["ETag"] = etag(doc)
         
         return {
             "message": "Job updated successfully",
-            "modified_count": result.modified_count
+            "modified_count": int(modified),
+            "data": doc
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.patch("/mongodb/{job_id}")
+def patch_job(job_id: str, job: JobPatch, response: Response, if_match: Optional[str] = Header(None)):
+    """Partially update a job document: only the (nested) fields sent are changed"""
+    return update_job(job_id, job, response, if_match)
+
 @app.delete("/mongodb/{job_id}")
 def delete_job(job_id: str):
     """Delete a job document by job_id"""
@@ -223,6 +460,7 @@ def delete_job(job_id: str):
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Document not found")
+        stats_cache.invalidate()
         
         return {
             "message": "Job deleted successfully",
@@ -235,6 +473,90 @@ def delete_job(job_id: str):
 # /STAGING ENDPOINT
 # ========================
 
+# Near-duplicate job_desc detection on ingest (same tender from several providers), see dedup.py
+staging_duplicates = DuplicateDetector(
+    get_staging_collection, threshold=float(os.environ.get("DEDUP_THRESHOLD", "0.8"))
+)
+
+def build_duplicate_index():
+    try:
+        staging_duplicates.build()
+        print(f"✅ Duplicate index built ({len(staging_duplicates.index)} staging jobs)")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not build duplicate index (retried on next ingest): {e}")
+
+@app.on_event("startup")
+async def start_duplicate_index():
+    # In the background; an ingest arriving before it finishes waits for the build
+    app.state.duplicate_index_build = asyncio.create_task(asyncio.to_thread(build_duplicate_index))
+
+def ingest_staging_jobs(jobs: List[JobDocument], on_duplicate: str) -> List[dict]:
+    """Insert staging jobs, flagging or merging near-duplicates of existing jobs and of each other.
+
+    flag:  insert, with duplicate_of / duplicate_similarity set on the new document
+    merge: don't insert; record the copy's provider and URL in the original's `sources`
+    """
+    collection = get_staging_collection()
+    new_docs = {}  # id -> doc, in ingest order
+    merges = []
+    results = []
+
+    with staging_duplicates.lock:
+        for job in jobs:
+            doc = job.model_dump()
+            doc["_id"] = ObjectId()
+            signature = minhash(doc["job_desc"])
+
+            result = {"job_id": doc["job_id"], "status": "inserted", "duplicate_of": None, "similarity": None}
+            match = staging_duplicates.find(signature)
+            while match:
+                # Point at the original of the matched copy, so all copies of a tender share one
+                if match[0] in new_docs:
+                    original = new_docs[match[0]].get("duplicate_of", match[0])
+                    break
+                existing = collection.find_one({"_id": ObjectId(match[0])}, {"duplicate_of": 1})
+                if existing:
+                    original = existing.get("duplicate_of", match[0])
+                    if original != match[0] and not collection.count_documents({"_id": ObjectId(original)}, limit=1):
+                        original = match[0]  # the original is gone, the copy takes its place
+                    break
+                # Deleted since it was indexed (e.g. through another worker)
+                staging_duplicates.remove(match[0])
+                match = staging_duplicates.find(signature)
+            if match:
+                duplicate_of = original
+                result.update(duplicate_of=duplicate_of, similarity=round(match[1], 3))
+                STAGING_DUPLICATES.labels(on_duplicate).inc()
+
+            if match and on_duplicate == "merge":
+                source = {key: doc.get(key) for key in ("job_id", "serviceProvider", "job_url")}
+                if duplicate_of in new_docs:
+                    new_docs[duplicate_of].setdefault("sources", []).append(source)
+                else:
+                    merges.append(UpdateOne({"_id": ObjectId(duplicate_of)}, {"$addToSet": {"sources": source}}))
+                result.update(status="merged", id=duplicate_of)
+            else:
+                if match:
+                    doc["duplicate_of"] = duplicate_of
+                    doc["duplicate_similarity"] = result["similarity"]
+                    result["status"] = "flagged"
+                new_docs[str(doc["_id"])] = doc
+                # Indexed now so later copies in the same batch are caught too
+                staging_duplicates.add(doc["_id"], signature)
+                result["id"] = str(doc["_id"])
+            results.append(result)
+
+        try:
+            if new_docs:
+                collection.insert_many(list(new_docs.values()))
+            if merges:
+                collection.bulk_write(merges, ordered=False)
+        except Exception:
+            for key in new_docs:
+                staging_duplicates.remove(key)
+            raise
+    return results
+
 @app.get("/staging")
 def get_all_staging_jobs():
     """Get all staging job documents from MongoDB"""
@@ -248,7 +570,7 @@ def get_all_staging_jobs():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/staging/{job_id}")
-def get_staging_job(job_id: str):
+def get_staging_job(job_id: str, response: Response):
     """Get a specific staging job document by job_id"""
     try:
         collection = get_staging_collection()
@@ -256,62 +578,88 @@ def get_staging_job(job_id: str):
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
         doc["_id"] = str(doc["_id"])
+        response.headers["ETag"] = etag(doc)
         return doc
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/staging")
-def create_staging_job(job: JobDocument):
-    """Create a new staging job document"""
+def create_staging_job(job: JobDocument, on_duplicate: Literal["flag", "merge"] = "flag"):
+    """Create a new staging job document, detecting near-duplicate descriptions"""
     try:
-        collection = get_staging_collection()
-        doc = job.model_dump()
-        result = collection.insert_one(doc)
+        [result] = ingest_staging_jobs([job], on_duplicate)
         return {
-            "message": "Staging job posted successfully",
-            "id": str(result.inserted_id)
+            "message": "Merged into existing staging job" if result["status"] == "merged"
+                       else "Staging job posted successfully",
+            "id": result["id"],
+            "duplicate_of": result["duplicate_of"],
+            "similarity": result["similarity"]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/staging/bulk")
+def create_staging_jobs(jobs: List[JobDocument], on_duplicate: Literal["flag", "merge"] = "flag"):
+    """Create several staging jobs at once, detecting duplicates against existing jobs and within the batch"""
+    if not jobs:
+        raise HTTPException(status_code=400, detail="No jobs to insert")
+    try:
+        results = ingest_staging_jobs(jobs, on_duplicate)
+        return {
+            "message": "Staging jobs processed",
+            "inserted": sum(r["status"] == "inserted" for r in results),
+            "flagged": sum(r["status"] == "flagged" for r in results),
+            "merged": sum(r["status"] == "merged" for r in results),
+            "results": results
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/staging/{job_id}")
-def update_staging_job(job_id: str, job: JobUpdate):
-    """Update an existing staging job document by job_id"""
+def update_staging_job(job_id: str, job: JobUpdate, response: Response, if_match: Optional[str] = Header(None)):
+    """Update an existing staging job document by job_id (nested objects are merged, not replaced)"""
     try:
-        collection = get_staging_collection()
-        update_data = job.model_dump(exclude_unset=True, exclude_none=True)
-        
-        if not update_data:
-            raise HTTPException(status_code=400, detail="No fields to update")
-        
-        result = collection.update_one(
-            {"job_id": job_id},
-            {"$set": update_data}
-        )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Document not found")
+        update_data = job_update_data(job)
+        doc, modified = update_document(get_staging_collection(), {"job_id": job_id}, update_data, if_match)
+        if modified and "job_desc" in update_data:
+            with staging_duplicates.lock:
+                staging_duplicates.remove(doc["_id"])
+                staging_duplicates.add(doc["_id"], minhash(doc["job_desc"]))
+        doc["_id"] = str(doc["_id"])
+        response.headers["ETag"] = etag(doc)
         
         return {
             "message": "Staging job updated successfully",
-            "modified_count": result.modified_count
+            "modified_count": int(modified),
+            "data": doc
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.patch("/staging/{job_id}")
+def patch_staging_job(job_id: str, job: JobPatch, response: Response, if_match: Optional[str] = Header(None)):
+    """Partially update a staging job document: only the (nested) fields sent are changed"""
+    return update_staging_job(job_id, job, response, if_match)
+
 @app.delete("/staging/{job_id}")
 def delete_staging_job(job_id: str):
     """Delete a staging job document by job_id"""
     try:
         collection = get_staging_collection()
-        result = collection.delete_one({"job_id": job_id})
+        doc = collection.find_one_and_delete({"job_id": job_id}, projection={"_id": 1})
         
-        if result.deleted_count == 0:
+        if doc is None:
             raise HTTPException(status_code=404, detail="Document not found")
+        with staging_duplicates.lock:
+            staging_duplicates.remove(doc["_id"])
         
         return {
             "message": "Staging job deleted successfully",
-            "deleted_count": result.deleted_count
+            "deleted_count": 1
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -333,7 +681,7 @@ def get_all_users():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/users/{user_id}")
-def get_user(user_id: str):
+def get_user(user_id: str, response: Response):
     """Get a specific user document by id"""
     try:
         collection = get_users_collection()
@@ -341,7 +689,10 @@ def get_user(user_id: str):
         if not doc:
             raise HTTPException(status_code=404, detail="User not found")
         doc["_id"] = str(doc["_id"])
+        response.headers["ETag"] = etag(doc)
         return doc
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -368,26 +719,21 @@ def create_user(user: User):
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.put("/users/{user_id}")
-def update_user(user_id: str, user: UserUpdate):
-    """Update an existing user document by id"""
+@app.patch("/users/{user_id}")
+def update_user(user_id: str, user: UserUpdate, response: Response, if_match: Optional[str] = Header(None)):
+    """Update an existing user document by id (only the fields sent are changed)"""
     try:
-        collection = get_users_collection()
-        update_data = user.model_dump(exclude_unset=True, exclude_none=True)
-        
-        if not update_data:
-            raise HTTPException(status_code=400, detail="No fields to update")
-        
-        result = collection.update_one(
-            {"id": user_id},
-            {"$set": update_data}
+        doc, modified = update_document(
+            get_users_collection(), {"id": user_id},
+            user.model_dump(exclude_unset=True, exclude_none=True), if_match, "User not found"
         )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="User not found")
+        doc["_id"] = str(doc["_id"])
+        response.headers["ETag"] = etag(doc)
         
         return {
             "message": "User updated successfully",
-            "modified_count": result.modified_count
+            "modified_count": int(modified),
+            "data": doc
         }
     except HTTPException:
         raise
@@ -415,11 +761,39 @@ def delete_user(user_id: str):
 # /SKILLBOY ENDPOINT
 # ========================
 
-@app.post("/skillboy")
-async def extract_skills_from_text(request: SkillExtractionRequest) -> SkillExtractionResponse:
+# Extraction runs on its own bounded pool, so a burst can't take every thread of the
+# default executor (mail outbox, GridFS) and queued calls wait on the event loop where
+# their queue time is measured and bounded (503 when full, 429 per client over the rate)
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", default_extraction_workers()))
+extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="skillboy")
+extraction_slots = ConcurrencyLimiter(
+    "/skillboy",
+    limit=EXTRACTION_WORKERS,
+    max_queue=int(os.environ.get("SKILLBOY_MAX_QUEUE", "32")),
+    queue_timeout=float(os.environ.get("SKILLBOY_QUEUE_TIMEOUT", "30")),
+)
+skillboy_rate = env_rate_limiter("/skillboy", "SKILLBOY", rate_per_minute=120, burst=20)
+
+def timed_extract_skills(text, engine):
+    """engine.extract, timed inside the worker thread (excludes queueing)"""
+    with EXTRACTION_LATENCY.time():
+        skills, cache_hit = engine.extract(text)
+    if engine.cache_size:
+        SKILL_CACHE_LOOKUPS.labels("hit" if cache_hit else "miss").inc()
+    return skills
+
+@app.post("/skillboy", dependencies=[Depends(skillboy_rate)])
+async def extract_skills_from_text(request: SkillExtractionRequest, response: Response) -> SkillExtractionResponse:
     """Extract skills from text using the skill extractor model (timeout: 120 seconds)"""
     try:
-        if not extractor:
+        current = engine  # keep one engine for the whole request, even if a reload swaps it
+        if not current:
+            if reload_state.progress.active:
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Skill extractor is loading ({reload_state.progress.step}), retry shortly",
+                    headers={"Retry-After": "5"}
+                )
             raise HTTPException(
                 status_code=503,
                 detail="Skill extractor not loaded. Make sure skill_db_relax_25.json exists."
@@ -428,11 +802,18 @@ async def extract_skills_from_text(request: SkillExtractionRequest) -> SkillExtr
         if not request.text or not request.text.strip():
             raise HTTPException(status_code=400, detail="Text field cannot be empty")
         
-        # Run extraction with 120 second timeout
+        EXTRACTION_TEXT_LENGTH.observe(len(request.text))
+        
+        # Run extraction with 120 second timeout (not counting the wait for a slot)
+        loop = asyncio.get_running_loop()
         try:
-            skills = await asyncio.wait_for(
-                asyncio.to_thread(extract_skills, request.text, extractor),
-                timeout=120.0
+            with EXTRACTION_IN_FLIGHT.track_inprogress():
+                start = loop.time()
+                skills, queued = await extraction_slots.run_in_executor(
+                    extraction_executor, timed_extract_skills, request.text, current, timeout=120.0
+                )
+            response.headers["Server-Timing"] = (
+                f"queue;dur={queued * 1000:.1f}, extract;dur={(loop.time() - start - queued) * 1000:.1f}"
             )
         except asyncio.TimeoutError:
             raise HTTPException(
@@ -472,11 +853,48 @@ async def extract_skills_from_text(request: SkillExtractionRequest) -> SkillExtr
 
 @app.get("/skillboy/health")
 def skillboy_health():
-    """Check if skill extractor is loaded"""
-    return {
-        "status": "ready" if extractor else "not_loaded",
-        "message": "Skill extractor is ready" if extractor else "Skill extractor not loaded"
+    """Check if skill extractor is loaded, and which skill DB version it uses"""
+    current = engine
+    progress = reload_state.progress
+    if current:
+        status, message = "ready", "Skill extractor is ready"
+    elif progress.active:
+        status, message = "loading", "Skill extractor is loading"
+    else:
+        status, message = "not_loaded", "Skill extractor not loaded"
+    health = {
+        "status": status,
+        "message": message,
+        "reloading": reload_state.reloading,
+        "loading": progress.info(),
+    }
+    if progress.failed and not current:
+        health["load_error"] = progress.failed
+    health["extraction"] = {
+        "workers": EXTRACTION_WORKERS,
+        "running": extraction_slots.active,
+        "queued": extraction_slots.waiting,
     }
+    if current:
+        health["skill_db"] = current.info()
+    if reload_state.last_error:
+        health["last_reload_error"] = reload_state.last_error
+    return health
+
+@app.post("/skillboy/reload", status_code=202, dependencies=[Depends(require_admin)])
+async def reload_skillboy():
+    """Rebuild the extractor from the skill DB files on disk and swap it in without downtime"""
+    parent = launcher_pid()
+    if parent:
+        # serve.py rebuilds once in the parent and replaces the workers one generation at a time
+        os.kill(parent, signal.SIGHUP)
+        return {"message": "Rolling reload requested from the launcher", "mode": "rolling"}
+
+    if reload_state.lock.locked():
+        raise HTTPException(status_code=409, detail="A skill DB load or reload is already in progress")
+    # Keep a reference so the task isn't garbage collected before it finishes
+    app.state.skill_db_reload = asyncio.create_task(asyncio.to_thread(reload_skill_db))
+    return {"message": "Skill DB reload started, see GET /skillboy/health", "mode": "in_process"}
 
 # ========================
 # MAIL ENDPOINT
@@ -484,6 +902,9 @@ def skillboy_health():
 
 # Initialize mail sender (lazy loading on first use)
 mail_sender_instance = None
+mail_outbox = None
+# Per client, shared by POST /mail and POST /mail/bulk
+mail_rate = env_rate_limiter("/mail", "MAIL_API", rate_per_minute=60, burst=10)
 
 def get_mail_sender() -> MailSender:
     """Get or initialize the mail sender with application authentication."""
@@ -497,13 +918,56 @@ def get_mail_sender() -> MailSender:
             authority=AZURE_URI,
             client_secret=AZURE_SECRET,
             mailbox_email=AZURE_MAILBOX,
-            scopes=scopes
+            scopes=scopes,
+            # GRAPH_URL / GRAPH_STATIC_TOKEN point the sender at a local Graph stub
+            graph_url=os.environ.get("GRAPH_URL", GRAPH_URL),
+            static_token=os.environ.get("GRAPH_STATIC_TOKEN")
         )
         mail_sender_instance.authenticate()
     
     return mail_sender_instance
 
-@app.post("/mail")
+@app.on_event("startup")
+async def start_mail_outbox():
+    global mail_outbox
+    try:
+        mail_outbox = MailOutbox(
+            MongoClient(MONGO_URI)[DB_NAME],
+            sender_factory=get_mail_sender,
+            workers=int(os.environ.get("MAIL_WORKERS", "4")),
+            max_attempts=int(os.environ.get("MAIL_MAX_ATTEMPTS", "5")),
+            rate_per_minute=float(os.environ.get("MAIL_RATE_PER_MINUTE", "30")),
+            lease_seconds=float(os.environ.get("MAIL_LEASE_SECONDS", "60"))
+        )
+        await mail_outbox.start()
+    except Exception as e:
+        mail_outbox = None
+        print(f"⚠️ Warning: Could not start mail outbox: {e}")
+
+@app.on_event("shutdown")
+async def stop_mail_outbox():
+    if mail_outbox:
+        await mail_outbox.stop()
+
+def parse_addresses(addresses: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated address list, dropping blanks."""
+    if not addresses:
+        return None
+    return [addr.strip() for addr in addresses.split(",") if addr.strip()] or None
+
+def spooled_attachments(attachments: Optional[List[UploadFile]]) -> list:
+    """(filename, spooled stream) pairs of the uploads; 413 if one is too large to ever be sent."""
+    files = []
+    for file in attachments or []:
+        if stream_size(file.file) > UPLOAD_SESSION_LIMIT:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Attachment {file.filename} is over the {UPLOAD_SESSION_LIMIT // (1024 * 1024)} MB limit"
+            )
+        files.append((file.filename, file.file))
+    return files
+
+@app.post("/mail", status_code=202, dependencies=[Depends(mail_rate)])
 async def send_email(
     to_addresses: str = Form(..., description="Comma-separated list of recipient email addresses"),
     subject: str = Form(..., description="Email subject"),
@@ -514,7 +978,10 @@ async def send_email(
     attachments: Optional[List[UploadFile]] = File(None, description="Files to attach (PDF, PNG, JPEG, etc.)")
 ) -> dict:
     """
-    Send an email with optional attachments.
+    Queue an email with optional attachments for delivery.
+    
+    The message is persisted to the outbox and sent in the background;
+    poll `GET /mail/{message_id}` for its delivery status.
     
     Parameters:
     - to_addresses: Comma-separated email addresses (required)
@@ -526,67 +993,142 @@ async def send_email(
     - attachments: Files to attach (optional, supports PDF, PNG, JPEG, etc.)
     
     Returns:
-    - JSON response with status and message
+    - JSON response with the queued message id
     """
     try:
+        if not mail_outbox:
+            raise HTTPException(status_code=503, detail="Mail outbox not available")
+        
         # Parse email addresses
-        to_list = [addr.strip() for addr in to_addresses.split(",") if addr.strip()]
+        to_list = parse_addresses(to_addresses)
         if not to_list:
             raise HTTPException(status_code=400, detail="At least one recipient email is required")
         
-        cc_list = [addr.strip() for addr in cc_addresses.split(",") if addr.strip()] if cc_addresses else None
-        bcc_list = [addr.strip() for addr in bcc_addresses.split(",") if addr.strip()] if bcc_addresses else None
+        cc_list = parse_addresses(cc_addresses)
+        bcc_list = parse_addresses(bcc_addresses)
+        
+        # Hand the spooled upload streams straight to the outbox (no extra copies)
+        files = spooled_attachments(attachments)
+        
+        message_id = await asyncio.to_thread(
+            mail_outbox.enqueue,
+            to_addresses=to_list,
+            subject=subject,
+            body=body,
+            attachments=files,
+            cc_addresses=cc_list,
+            bcc_addresses=bcc_list,
+            is_html=is_html
+        )
+        
+        return {
+            "status": "queued",
+            "id": message_id,
+            "message": f"Email queued for {', '.join(to_list)}",
+            "recipients": {
+                "to": to_list,
+                "cc": cc_list,
+                "bcc": bcc_list
+            },
+            "attachments_count": len(files)
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ERROR] Unexpected error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error queuing email: {str(e)}")
+
+@app.post("/mail/bulk", status_code=202, dependencies=[Depends(mail_rate)])
+async def send_bulk_email(
+    subject: str = Form(..., description="Subject template, e.g. 'New RFP for ${name}'"),
+    body: str = Form(..., description="Body template with ${variable} placeholders"),
+    recipients: str = Form(..., description='JSON list of {"to": "...", "variables": {...}}'),
+    cc_addresses: Optional[str] = Form(None, description="Comma-separated CC addresses, added to every message"),
+    bcc_addresses: Optional[str] = Form(None, description="Comma-separated BCC addresses, added to every message"),
+    is_html: bool = Form(True, description="Whether body is HTML (default True)"),
+    attachments: Optional[List[UploadFile]] = File(None, description="Files attached to every message")
+) -> dict:
+    """
+    Queue a templated email for many recipients (mail merge).
+    
+    Each recipient gets its own message with `${variable}` placeholders filled
+    from its variables (HTML-escaped when is_html). Shared attachments are
+    stored once for the whole batch. Poll `GET /mail/bulk/{batch_id}` for
+    per-recipient results.
+    """
+    try:
+        if not mail_outbox:
+            raise HTTPException(status_code=503, detail="Mail outbox not available")
         
-        # Save uploaded files to temporary location
-        temp_files = []
         try:
-            if attachments:
-                for file in attachments:
-                    # Create temporary file
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp_file:
-                        content = await file.read()
-                        tmp_file.write(content)
-                        temp_files.append(tmp_file.name)
-            
-            # Get mail sender and send email
-            sender = get_mail_sender()
-            success = sender.send_email(
-                to_addresses=to_list,
-                subject=subject,
-                body=body,
-                attachments=temp_files if temp_files else None,
-                cc_addresses=cc_list,
-                bcc_addresses=bcc_list,
-                is_html=is_html
-            )
-            
-            if success:
-                return {
-                    "status": "success",
-                    "message": f"Email sent successfully to {', '.join(to_list)}",
-                    "recipients": {
-                        "to": to_list,
-                        "cc": cc_list,
-                        "bcc": bcc_list
-                    },
-                    "attachments_count": len(temp_files)
-                }
-            else:
-                raise HTTPException(status_code=500, detail="Failed to send email")
+            entries = json.loads(recipients)
+            if not isinstance(entries, list):
+                raise ValueError('expected a JSON list of {"to": ..., "variables": {...}} objects')
+            entries = [BulkRecipient.model_validate(entry) for entry in entries]
+        except ValueError as e:
+            # Also pydantic's ValidationError: not an object, blank or malformed "to"
+            raise HTTPException(status_code=400, detail=f"Invalid recipients: {e}")
+        if not entries:
+            raise HTTPException(status_code=400, detail="At least one recipient is required")
+        
+        # Render everything up front so a bad template fails before anything is queued
+        messages = []
+        for entry in entries:
+            try:
+                messages.append({
+                    "to": entry.to,
+                    "subject": render_template(subject, entry.variables),
+                    "body": render_template(body, entry.variables, escape=is_html)
+                })
+            except (KeyError, ValueError) as e:
+                raise HTTPException(status_code=400, detail=f"Template error for {entry.to}: missing or invalid placeholder {e}")
         
-        finally:
-            # Clean up temporary files
-            for temp_file in temp_files:
-                try:
-                    os.remove(temp_file)
-                except Exception as e:
-                    print(f"[WARN] Error deleting temp file {temp_file}: {e}")
+        files = spooled_attachments(attachments)
+        batch_id, message_ids = await asyncio.to_thread(
+            mail_outbox.enqueue_batch,
+            messages,
+            attachments=files,
+            cc_addresses=parse_addresses(cc_addresses),
+            bcc_addresses=parse_addresses(bcc_addresses),
+            is_html=is_html
+        )
+        
+        return {
+            "status": "queued",
+            "batch_id": batch_id,
+            "count": len(message_ids),
+            "messages": [{"to": m["to"], "id": message_id} for m, message_id in zip(messages, message_ids)],
+            "attachments_count": len(files)
+        }
     
     except HTTPException:
         raise
     except Exception as e:
         print(f"[ERROR] Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail=f"Error sending email: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error queuing bulk email: {str(e)}")
+
+@app.get("/mail/bulk/{batch_id}")
+def get_bulk_email_status(batch_id: str):
+    """Get per-recipient delivery results of a bulk send"""
+    if not mail_outbox:
+        raise HTTPException(status_code=503, detail="Mail outbox not available")
+    status = mail_outbox.get_batch(batch_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+@app.get("/mail/{message_id}")
+def get_email_status(message_id: str):
+    """Get the delivery status of a queued email"""
+    if not mail_outbox:
+        raise HTTPException(status_code=503, detail="Mail outbox not available")
+    if not ObjectId.is_valid(message_id):
+        raise HTTPException(status_code=400, detail="Invalid message id")
+    status = mail_outbox.get(message_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return status
 
 # ========================
 # HEALTH CHECK
@@ -600,6 +1142,73 @@ def health_check():
         "message": "FuturScam API is running"
     }
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process and its event loop respond (restart the instance if not)"""
+    return {"status": "alive"}
+
+health_client = None  # one MongoClient for the readiness probe, created on first use
+
+def ping_mongo():
+    global health_client
+    if health_client is None:
+        health_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=2000)
+    health_client.admin.command("ping")
+
+@app.get("/health/ready")
+async def readiness(response: Response):
+    """Readiness probe: 200 when MongoDB answers and the mail outbox runs, 503 otherwise.
+
+    The skill extractor is not part of it: while it loads, every other route is served
+    and /skillboy answers 503 on its own (see /skillboy/health).
+    """
+    checks = {}
+    try:
+        await asyncio.wait_for(asyncio.to_thread(ping_mongo), timeout=3.0)
+        checks["mongodb"] = "ok"
+    except Exception as e:
+        checks["mongodb"] = f"error: {e}"
+    checks["mail_outbox"] = "ok" if mail_outbox else "not_started"
+    ready = all(check == "ok" for check in checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "not_ready", "checks": checks}
+
+# ========================
+# METRICS
+# ========================
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# ========================
+# PROFILING (ADMIN)
+# ========================
+
+@app.get("/profiles", dependencies=[Depends(require_admin)], include_in_schema=False)
+def list_profiles():
+    """List the most recent request profiles"""
+    return {"enabled": profiling_enabled(), "data": profiles.list()}
+
+@app.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)], include_in_schema=False)
+def get_profile(profile_id: str):
+    """Get a profile summary with its spaCy / skillNer / Mongo breakdown"""
+    profile = profiles.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile[0]
+
+@app.get("/profiles/{profile_id}/folded", dependencies=[Depends(require_admin)], include_in_schema=False)
+def get_profile_folded(profile_id: str):
+    """Get a profile as folded stacks (flamegraph.pl / speedscope input)"""
+    profile = profiles.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile[1])
+
 # ========================
 # ROOT ENDPOINT
 # ========================
@@ -612,22 +1221,38 @@ def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "GET /health - API health check",
-            "mail": "POST /mail - Send email with attachments",
+            "probes": "GET /health/live (liveness), GET /health/ready (readiness: MongoDB and mail outbox)",
+            "metrics": "GET /metrics - Prometheus metrics",
+            "mail": {
+                "send": "POST /mail - Queue email with attachments (202 + message id)",
+                "status": "GET /mail/{message_id} - Get delivery status",
+                "bulk": "POST /mail/bulk - Queue a templated email for many recipients",
+                "bulk_status": "GET /mail/bulk/{batch_id} - Get per-recipient results"
+            },
             "mongodb": {
                 "get_all": "GET /mongodb - Get all RFPs",
                 "get_one": "GET /mongodb/{doc_id} - Get specific RFP",
                 "create": "POST /mongodb - Create new RFP",
-                "update": "PUT /mongodb/{doc_id} - Update RFP",
-                "delete": "DELETE /mongodb/{doc_id} - Delete RFP"
+                "update": "PUT|PATCH /mongodb/{doc_id} - Update RFP (If-Match: <ETag> to detect conflicts)",
+                "delete": "DELETE /mongodb/{doc_id} - Delete RFP",
+                "stats": "GET /mongodb/stats[/skills|/counts/{field}|/daily-rates|/deadlines] - Aggregated RFP statistics"
+            },
+            "staging": {
+                "create": "POST /staging?on_duplicate=flag|merge - Create staging RFP, detecting near-duplicates",
+                "bulk": "POST /staging/bulk?on_duplicate=flag|merge - Create several staging RFPs",
+                "update": "PUT|PATCH /staging/{job_id} - Update staging RFP (If-Match: <ETag> to detect conflicts)"
             },
             "skillboy": {
                 "extract": "POST /skillboy - Extract skills from text",
-                "health": "GET /skillboy/health - Check extractor status"
+                "health": "GET /skillboy/health - Check extractor status and skill DB version",
+                "reload": "POST /skillboy/reload - Reload the skill DB without restart (admin)"
             }
         }
     }
 
 if __name__ == "__main__":
-    import uvicorn
+    import sys
     
-    uvicorn.run(app, host="0.0.0.0", port=8000, timeout_keep_alive=120)
+    # Hand over to the pre-fork launcher (same arguments, e.g. --workers 4). It has to
+    # start from a fresh interpreter so multi-worker metrics are set up before import.
+    os.execv(sys.executable, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")] + sys.argv[1:])
@@ -0,0 +1,222 @@
+"""
+Prometheus metrics for the FuturScam API.
+
+All collectors live here so every module records into the same registry;
+`/metrics` in main.py renders them. Recording is a dict lookup plus an
+atomic add, so instrumentation stays on in production.
+
+Under serve.py with several workers, PROMETHEUS_MULTIPROC_DIR is set before
+this module is imported and /metrics aggregates every worker's values.
+"""
+
+import os
+
+import asyncio
+import time
+
+from anyio import to_thread
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+# Latency buckets (seconds) from fast CRUD calls up to the 120 s extraction timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# ========================
+# HTTP
+# ========================
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being served", multiprocess_mode="livesum"
+)
+
+# Per-route guards (limits.py)
+ROUTE_ACTIVE = Gauge(
+    "route_concurrency_active", "Calls holding a concurrency slot", ["route"], multiprocess_mode="livesum"
+)
+ROUTE_QUEUED = Gauge(
+    "route_concurrency_queued", "Calls waiting for a concurrency slot", ["route"], multiprocess_mode="livesum"
+)
+ROUTE_QUEUE_SECONDS = Histogram(
+    "route_queue_seconds", "Time spent waiting for a concurrency slot", ["route"], buckets=LATENCY_BUCKETS
+)
+ROUTE_REJECTED = Counter(
+    "route_rejected_total", "Calls rejected by rate or concurrency limits", ["route", "reason"]
+)
+
+# ========================
+# MONGODB
+# ========================
+
+MONGO_LATENCY = Histogram(
+    "mongo_operation_duration_seconds", "MongoDB command latency", ["collection", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+MONGO_FAILURES = Counter(
+    "mongo_operation_failures_total", "Failed MongoDB commands", ["collection", "operation"]
+)
+
+# ========================
+# SKILL EXTRACTION
+# ========================
+
+EXTRACTION_LATENCY = Histogram(
+    "skill_extraction_duration_seconds", "Time spent in extract_skills", buckets=LATENCY_BUCKETS
+)
+EXTRACTION_TEXT_LENGTH = Histogram(
+    "skill_extraction_text_length_chars", "Length of texts sent to /skillboy",
+    buckets=(100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+)
+EXTRACTION_IN_FLIGHT = Gauge(
+    "skill_extraction_in_flight", "Extractions running or waiting for a thread", multiprocess_mode="livesum"
+)
+EXTRACTOR_LOAD_SECONDS = Gauge(
+    "skill_extractor_load_seconds", "Time taken to build the current skill extractor", multiprocess_mode="max"
+)
+SKILL_DB_RELOADS = Counter(
+    "skill_db_reloads_total", "Skill DB hot reloads", ["result"]
+)
+SKILL_CACHE_LOOKUPS = Counter(
+    "skill_extraction_cache_total", "Extraction cache lookups", ["result"]
+)
+
+# ========================
+# STAGING INGEST
+# ========================
+
+STAGING_DUPLICATES = Counter(
+    "staging_duplicates_total", "Near-duplicate job descriptions detected on staging ingest", ["action"]
+)
+
+# ========================
+# MAIL
+# ========================
+
+MAIL_SEND_LATENCY = Histogram(
+    "mail_send_duration_seconds", "MailSender.deliver latency", ["mode"], buckets=LATENCY_BUCKETS
+)
+MAIL_SEND_FAILURES = Counter(
+    "mail_send_failures_total", "Failed MailSender.deliver calls", ["status"]
+)
+
+# ========================
+# THREAD POOLS
+# ========================
+
+# Sampled by the worker serving the scrape, so kept per process ("liveall")
+THREADPOOL_BORROWED = Gauge(
+    "threadpool_busy_threads", "Busy threads in the pool used by sync routes (anyio)", multiprocess_mode="liveall"
+)
+THREADPOOL_WAITING = Gauge(
+    "threadpool_waiting_tasks", "Sync route calls waiting for a free thread (anyio)", multiprocess_mode="liveall"
+)
+EXECUTOR_QUEUE = Gauge(
+    "executor_queue_depth", "Work items queued on the asyncio default executor (asyncio.to_thread)",
+    multiprocess_mode="liveall"
+)
+
+
+def _anyio_limiter():
+    try:
+        return to_thread.current_default_thread_limiter()
+    except Exception:
+        return None  # no running event loop (e.g. during import)
+
+
+def _executor_queue_depth() -> int:
+    try:
+        executor = asyncio.get_running_loop()._default_executor
+    except RuntimeError:
+        return 0
+    return executor._work_queue.qsize() if executor is not None else 0
+
+
+def _sample_pools():
+    """Refresh pool gauges; called at scrape time so serving requests pays nothing."""
+    limiter = _anyio_limiter()
+    if limiter is not None:
+        stats = limiter.statistics()
+        THREADPOOL_BORROWED.set(stats.borrowed_tokens)
+        THREADPOOL_WAITING.set(stats.tasks_waiting)
+    EXECUTOR_QUEUE.set(_executor_queue_depth())
+
+
+def render_metrics():
+    """Return (body, content_type) for the /metrics endpoint. Must run on the event loop."""
+    _sample_pools()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command, labelled by collection and command name."""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        # The collection name is the value of the command's first key, e.g. {"find": "RFP"}
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else "-"
+        )
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "-")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "-")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_FAILURES.labels(collection, event.command_name).inc()
+
+
+# Applies to every MongoClient created after import
+monitoring.register(MongoCommandMetrics())
+
+
+class PrometheusMiddleware:
+    """ASGI middleware recording request count and latency per route, plus requests in flight.
+
+    Requests are labelled with the route template (`/mongodb/{job_id}`), not the
+    raw path, to keep label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            HTTP_LATENCY.labels(scope["method"], path).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(scope["method"], path, str(status)).inc()
@@ -0,0 +1,231 @@
+"""
+Opt-in per-request sampling profiler.
+
+Enabled only when PROFILING_ENABLED=1 at startup; otherwise the middleware is
+not even installed. An admin then profiles a single request by sending
+`X-Profile: 1` (or `?profile=1`) together with `X-Admin-Token`.
+
+A background thread samples the stacks of all threads every
+PROFILE_INTERVAL_MS (default 5 ms) while the request runs. This follows work
+handed to worker threads (asyncio.to_thread, sync routes), which cProfile
+cannot. Only one request is profiled at a time, but other traffic on the same
+worker during that window is sampled too, so profile on a quiet instance when
+possible.
+
+Each profile keeps:
+- folded stacks ("frame;frame;frame count" lines) for flamegraph.pl,
+  speedscope or inferno
+- a breakdown of samples into spaCy pipeline components, skillNer
+  matching, MongoDB I/O and everything else
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Optional
+from urllib.parse import parse_qs
+
+from auth import is_admin_token
+
+# Profiles kept in memory for GET /profiles/{id}
+MAX_PROFILES = 20
+# Frames whose leaf is here are idle threads (pool workers waiting, event loop in select)
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"))
+
+
+def _category(frame) -> str:
+    """Attribute a sample to a component, scanning from the leaf towards the root."""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if "pymongo" in filename or f"{os.sep}bson{os.sep}" in filename:
+            return "mongo"
+        if "skillNer" in filename:
+            return "skillner"
+        if f"{os.sep}spacy{os.sep}" in filename or f"{os.sep}thinc{os.sep}" in filename:
+            return _spacy_category(frame)
+        frame = frame.f_back
+    return "other"
+
+
+def _spacy_category(frame) -> str:
+    """Name the pipeline component when inside Language.__call__; spaCy code called
+    directly by skillNer (matchers, spans) counts as skillNer matching."""
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "__call__" and code.co_filename.endswith("language.py"):
+            # The pipeline loop variable is the component name (unset while tokenizing)
+            name = frame.f_locals.get("name")
+            return f"spacy:{name}" if isinstance(name, str) else "spacy:tokenizer"
+        if "skillNer" in code.co_filename:
+            return "skillner"
+        frame = frame.f_back
+    return "spacy"
+
+
+def _folded(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval until stopped."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.categories = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code.co_filename.endswith(IDLE_FILES):
+                    continue
+                self.stacks[_folded(frame)] += 1
+                self.categories[_category(frame)] += 1
+                self.samples += 1
+
+
+class ProfileStore:
+    """Most recent profiles, in memory and optionally on disk (PROFILE_DIR)."""
+
+    def __init__(self, directory: Optional[str] = None, limit: int = MAX_PROFILES):
+        self.directory = directory
+        self.limit = limit
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile_id: str, method: str, path: str, status: int, profiler: SamplingProfiler):
+        folded = "\n".join(f"{stack} {count}" for stack, count in profiler.stacks.most_common())
+        total = profiler.samples or 1
+        summary = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "status": status,
+            "duration_seconds": round(profiler.duration, 4),
+            "interval_ms": profiler.interval * 1000,
+            "samples": profiler.samples,
+            "breakdown": {
+                category: {
+                    "samples": count,
+                    "share": round(count / total, 4),
+                    "seconds": round(count * profiler.interval, 4),
+                }
+                for category, count in profiler.categories.most_common()
+            },
+        }
+        with self._lock:
+            self._profiles[profile_id] = (summary, folded)
+            while len(self._profiles) > self.limit:
+                self._profiles.popitem(last=False)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{profile_id}.folded"), "w", encoding="utf-8") as f:
+                f.write(folded)
+
+    def get(self, profile_id: str):
+        """(summary, folded) or None."""
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [summary for summary, _ in reversed(self._profiles.values())]
+
+
+profiles = ProfileStore(directory=os.environ.get("PROFILE_DIR"))
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get("PROFILING_ENABLED") == "1"
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests flagged with `X-Profile: 1` or `?profile=1`.
+
+    The profile id is returned in the `X-Profile-Id` response header; results
+    are available from `GET /profiles/{id}` once the response is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        if not is_admin_token(headers.get(b"x-admin-token", b"").decode("latin-1")):
+            await self._reply(send, 403, b'{"detail":"Profiling requires an admin token"}')
+            return
+
+        if not self._busy.acquire(blocking=False):
+            # One profile at a time; run this request normally
+            await self.app(scope, receive, self._with_header(send, b"x-profile-skipped", b"busy"))
+            return
+
+        profile_id = uuid.uuid4().hex[:16]
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await self._with_header(send, b"x-profile-id", profile_id.encode("ascii"))(message)
+
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            self._busy.release()
+            profiles.add(profile_id, scope["method"], scope["path"], status, profiler)
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile" and value in (b"1", b"true"):
+                return True
+        query = scope.get("query_string", b"")
+        return b"profile" in query and parse_qs(query.decode("latin-1")).get("profile", [""])[0] in ("1", "true")
+
+    @staticmethod
+    def _with_header(send, name: bytes, value: bytes):
+        async def wrapped(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [(name, value)])
+            await send(message)
+        return wrapped
+
+    @staticmethod
+    async def _reply(send, status: int, body: bytes):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,235 @@
+"""
+RFP analytics computed by MongoDB aggregation pipelines.
+
+Each builder returns a pipeline for the RFP collection that starts with a
+$match on isActive (indexed, see STATS_INDEXES), so only the grouped results
+leave the server instead of every RFP document. Results are small, so
+StatsCache keeps them for a short TTL and main.py invalidates it on every
+write to the collection. The cache is per process: other serve.py workers and
+writers outside the API (backfill.py) only show up once its entries expire.
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from pymongo import ASCENDING, IndexModel
+
+# Fields the dashboards group by: query value -> document path
+COUNT_FIELDS = {
+    "city": "company.city",
+    "country": "company.country",
+    "region": "company.region",
+    "company": "company.name",
+    "seniority": "seniority",
+    "remote": "remoteOption",
+    "type": "RFP_type",
+    "provider": "serviceProvider",
+}
+
+# Daily rate buckets (lower bounds, in the document's currency)
+RATE_BOUNDARIES = [0, 300, 400, 500, 600, 700, 800, 1000, 1500, 1000000]
+# Days left until deadlineAt: 0-7, 7-14, ..., 90+
+DEADLINE_DAYS = [0, 7, 14, 30, 60, 90]
+
+STATS_INDEXES = [
+    IndexModel([("isActive", ASCENDING)]),
+    IndexModel([("isActive", ASCENDING), ("skills.name", ASCENDING)]),
+    IndexModel([("isActive", ASCENDING), ("company.city", ASCENDING)]),
+    IndexModel([("isActive", ASCENDING), ("seniority", ASCENDING)]),
+    IndexModel([("isActive", ASCENDING), ("deadlineAt", ASCENDING)]),
+]
+
+
+def _match(active: Optional[bool]) -> list:
+    return [{"$match": {"isActive": active}}] if active is not None else []
+
+
+def skills_pipeline(active: Optional[bool], limit: int) -> list:
+    """Skill frequency: number of RFPs mentioning each skill."""
+    return _match(active) + [
+        {"$unwind": "$skills"},
+        {"$match": {"skills.name": {"$nin": [None, ""]}}},
+        # A skill listed twice in one RFP counts once
+        {"$group": {"_id": {"skill": "$skills.name", "rfp": "$_id"}}},
+        {"$group": {"_id": "$_id.skill", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "skill": "$_id", "count": 1}},
+    ]
+
+
+def counts_pipeline(field: str, active: Optional[bool], limit: int) -> list:
+    """Number of RFPs per value of one of COUNT_FIELDS."""
+    return _match(active) + [
+        {"$group": {"_id": {"$ifNull": [f"${COUNT_FIELDS[field]}", None]}, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "value": "$_id", "count": 1}},
+    ]
+
+
+# Documents with at least one numeric daily rate bound
+_HAS_RATE = {"$match": {"$or": [
+    {"conditions.dailyRate.min": {"$type": "number"}},
+    {"conditions.dailyRate.max": {"$type": "number"}},
+]}}
+
+_RATE_SUMMARY = [
+    {"$group": {
+        "_id": {"$ifNull": ["$conditions.dailyRate.currency", None]},
+        "count": {"$sum": 1},
+        "min": {"$min": "$conditions.dailyRate.min"},
+        "max": {"$max": "$conditions.dailyRate.max"},
+        "avg_min": {"$avg": "$conditions.dailyRate.min"},
+        "avg_max": {"$avg": "$conditions.dailyRate.max"},
+    }},
+    {"$sort": {"count": -1}},
+    {"$project": {"_id": 0, "currency": "$_id", "count": 1, "min": 1, "max": 1, "avg_min": 1, "avg_max": 1}},
+]
+
+_RATE_BUCKETS = [
+    {"$bucket": {
+        # Missing minimum -> -1 -> "unknown" (below the first boundary)
+        "groupBy": {"$ifNull": ["$conditions.dailyRate.min", -1]},
+        "boundaries": RATE_BOUNDARIES,
+        "default": "unknown",
+        "output": {"count": {"$sum": 1}, "avg_max": {"$avg": "$conditions.dailyRate.max"}},
+    }},
+    {"$project": {"_id": 0, "from": "$_id", "count": 1, "avg_max": 1}},
+]
+
+
+def daily_rates_pipeline(active: Optional[bool]) -> list:
+    """Daily rate summary per currency, and the distribution of minimum rates."""
+    return _match(active) + [_HAS_RATE, {"$facet": {"summary": _RATE_SUMMARY, "buckets": _RATE_BUCKETS}}]
+
+
+def deadline_boundaries(today: date) -> list:
+    """$bucket boundaries over deadlineAt: past, then one bucket per DEADLINE_DAYS range.
+
+    deadlineAt is an ISO date string, so dates compare correctly as strings
+    ("2025-03-01T12:00:00Z" sorts after "2025-03-01") without converting every
+    document. Only the leading $match can use an index; $bucket scans the
+    matched documents.
+    """
+    return ["0"] + [(today + timedelta(days=days)).isoformat() for days in DEADLINE_DAYS] + ["9999-99"]
+
+
+# deadlineAt when it starts like an ISO date, else "unknown" (sorts after the last
+# boundary, so $bucket puts it in its default bucket): "15/12/2025" would sort as "past"
+_ISO_DEADLINE = {"$cond": [
+    {"$and": [
+        {"$eq": [{"$type": "$deadlineAt"}, "string"]},
+        {"$regexMatch": {"input": "$deadlineAt", "regex": r"^\d{4}-\d{2}-\d{2}"}},
+    ]},
+    "$deadlineAt",
+    "unknown",
+]}
+
+
+def deadlines_pipeline(active: Optional[bool], today: date) -> list:
+    """RFPs per number of days left until deadlineAt."""
+    return _match(active) + [
+        {"$bucket": {
+            "groupBy": _ISO_DEADLINE,
+            "boundaries": deadline_boundaries(today),
+            "default": "unknown",
+            "output": {"count": {"$sum": 1}},
+        }},
+    ]
+
+
+def overview_pipeline(today: date, top: int = 10) -> list:
+    """Everything the stats page shows first about active RFPs, in one round trip.
+
+    $facet sub-pipelines can't use indexes, so the $match on isActive comes
+    before it. The totals are counted separately (see main.get_stats_overview).
+    """
+    return _match(True) + [{"$facet": {
+        "top_skills": skills_pipeline(None, top),
+        "top_cities": counts_pipeline("city", None, top),
+        "seniority": counts_pipeline("seniority", None, top),
+        "daily_rates": [_HAS_RATE] + _RATE_SUMMARY,
+        "deadlines": deadlines_pipeline(None, today),
+    }}]
+
+
+def label_deadline_buckets(buckets: list, today: date) -> list:
+    """Replace the $bucket lower bounds (dates) by readable ranges: "past", "0-7", ..., "90+"."""
+    boundaries = deadline_boundaries(today)
+    labels = ["past"] + [f"{start}-{end}" for start, end in zip(DEADLINE_DAYS, DEADLINE_DAYS[1:])]
+    labels.append(f"{DEADLINE_DAYS[-1]}+")
+    by_start = dict(zip(boundaries, labels))
+    return [
+        {"range": by_start.get(bucket["_id"], "unknown"), "from": bucket["_id"], "count": bucket["count"]}
+        for bucket in buckets
+    ]
+
+
+def today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+class StatsCache:
+    """Short-TTL cache of aggregation results, cleared on writes.
+
+    Only one caller computes a missing key at a time; the others wait for its
+    result. A result computed across an invalidate() is returned but not stored.
+    Keys include the date, so expired entries are purged on every store and a
+    key's lock only exists while someone is computing or waiting for it.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}  # key -> (expires, value)
+        self._locks = {}  # key -> [lock, callers using it]
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get_or_compute(self, key, compute: Callable):
+        """Returns (value, cache_hit)."""
+        hit = self._get(key)
+        if hit is not None:
+            return hit, True
+        with self._lock:
+            key_lock = self._locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                hit = self._get(key)
+                if hit is not None:
+                    return hit, True
+                generation = self._generation
+                value = compute()
+                with self._lock:
+                    if self.ttl > 0 and generation == self._generation:
+                        self._purge_expired()
+                        self._entries[key] = (time.monotonic() + self.ttl, value)
+                return value, False
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._locks[key]
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self._entries.items() if expires < now]:
+            del self._entries[key]
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
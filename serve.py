@@ -0,0 +1,327 @@
+"""
+Multi-worker launcher for the FuturScam API.
+
+Usage:
+    python serve.py --workers 4 [--host 0.0.0.0] [--port 8000]
+
+The parent process imports the app, binds the listening socket and forks a
+first generation of uvicorn workers right away: they serve every route except
+/skillboy (503 "loading") within a second. Meanwhile the parent builds the skill
+extractor (spaCy, skillNer matchers, skill DB) once, freezes the garbage
+collector and replaces that generation with workers forked from itself. The
+workers share the extractor's memory pages copy-on-write instead of each
+loading their own copy, so adding a worker costs only its private memory.
+
+`uvicorn main:app --workers N` spawns fresh interpreters instead, so every
+worker loads its own extractor. `--no-preload` reproduces that behaviour
+with this launcher for comparison.
+
+Send SIGUSR1 to the parent (or pass --memory-report SECONDS) to print
+RSS / PSS / private memory for every worker. PSS divides shared pages
+between the processes mapping them, so the sum of PSS is the real memory
+cost of the whole server. Requires fork (Linux / macOS).
+
+Send SIGHUP (or POST /skillboy/reload from any worker) to reload the skill
+DB without downtime: the parent rebuilds the extractor while the current
+workers keep serving, forks a new generation of workers from it, then stops
+the old generation gracefully once every new worker reported that its
+extractor is ready (through a pipe, see main.notify_launcher). With
+SKILL_DB_WATCH_INTERVAL set, the parent also does this when the skill DB
+files change on disk.
+"""
+
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+
+def _smaps_rollup(pid: int) -> dict:
+    """Memory counters (kB) from /proc/<pid>/smaps_rollup (Linux)."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        pass
+    return values
+
+
+def memory_report(pids) -> str:
+    """Table of RSS, PSS and private (USS) memory in MB per process."""
+    rows = ["   pid      RSS MB   PSS MB   private MB"]
+    totals = [0.0, 0.0, 0.0]
+    for label, pid in pids:
+        m = _smaps_rollup(pid)
+        rss = m.get("Rss", 0) / 1024
+        pss = m.get("Pss", 0) / 1024
+        private = (m.get("Private_Clean", 0) + m.get("Private_Dirty", 0)) / 1024
+        totals = [totals[0] + rss, totals[1] + pss, totals[2] + private]
+        rows.append(f"{pid:>6}  {rss:>9.1f} {pss:>8.1f} {private:>12.1f}   {label}")
+    rows.append(f"{'total':>6}  {totals[0]:>9.1f} {totals[1]:>8.1f} {totals[2]:>12.1f}")
+    return "\n".join(rows)
+
+
+class Launcher:
+    """Pre-fork supervisor: loads the app once, forks workers, restarts crashed ones."""
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}  # pid -> (started, generation)
+        self.generation = 0
+        self.stopping = False
+        self.reload_requested = False
+        self.ready = set()  # workers whose extractor is ready (or failed to load)
+        self.retiring = []  # previous generations, stopped once the current one is ready
+        self.retire_deadline = 0.0
+        self.ready_buffer = b""
+
+    def bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET6 if ":" in self.args.host else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.args.host, self.args.port))
+        sock.listen(self.args.backlog)
+        sock.set_inheritable(True)
+        return sock
+
+    def spawn(self, sock: socket.socket, app, initial: bool = False):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = (time.monotonic(), self.generation)
+            return
+
+        # Child: default signal handling, then serve until uvicorn exits
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        os.close(self.ready_fd)
+        if not self.args.preload and not initial:
+            # Replacing a worker while others serve: don't take /skillboy requests
+            # before our own extractor is built
+            if not self.main.load_extractor():
+                os.environ["FUTURSCAM_PRELOAD"] = "failed"
+        import uvicorn
+        config = uvicorn.Config(app, timeout_keep_alive=120, log_level=self.args.log_level)
+        server = uvicorn.Server(config)
+        try:
+            server.run(sockets=[sock])
+        finally:
+            os._exit(0)
+
+    def run(self):
+        multiproc_dir = None
+        if self.args.workers > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            # Must be set before prometheus_client is imported (via main -> metrics)
+            multiproc_dir = tempfile.mkdtemp(prefix="futurscam-metrics-")
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = multiproc_dir
+
+        # Lets workers route POST /skillboy/reload to the parent (see main.launcher_pid)
+        os.environ["FUTURSCAM_LAUNCHER_PID"] = str(os.getpid())
+
+        # Tells the first workers the extractor is coming from the parent (see main.startup)
+        if self.args.preload:
+            os.environ["FUTURSCAM_PRELOAD"] = "loading"
+
+        # Workers write "<pid> ready|failed" here once their extractor is usable (see main.notify_launcher)
+        self.ready_fd, ready_write = os.pipe()
+        os.set_blocking(self.ready_fd, False)
+        os.environ["FUTURSCAM_READY_FD"] = str(ready_write)
+
+        import main
+        self.main = main
+
+        sock = self.bind()
+        print(f"[OK] Listening on http://{self.args.host}:{self.args.port} with {self.args.workers} workers "
+              f"({'loading the extractor in the parent' if self.args.preload else 'no preload'})")
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGUSR1, lambda *_: self._report())
+        signal.signal(signal.SIGHUP, self._request_reload)
+        if self.args.memory_report:
+            signal.signal(signal.SIGALRM, lambda *_: self._report())
+            signal.alarm(self.args.memory_report)
+
+        for _ in range(self.args.workers):
+            self.spawn(sock, main.app, initial=True)
+
+        try:
+            if self.args.preload:
+                self._preload(sock, main.app)
+            self._supervise(sock, main.app)
+        finally:
+            sock.close()
+            if multiproc_dir:
+                shutil.rmtree(multiproc_dir, ignore_errors=True)
+
+    def _supervise(self, sock, app):
+        from skill_engine import db_fingerprint
+
+        watch_interval = float(os.environ.get("SKILL_DB_WATCH_INTERVAL", "0"))
+        fingerprint, next_check = db_fingerprint(), time.monotonic() + watch_interval
+        while self.workers:
+            self._read_ready()
+            if self.retiring:
+                self._retire_when_ready()
+            if self.reload_requested and not self.stopping:
+                self.reload_requested = False
+                self._rolling_reload(sock, app)
+            if watch_interval > 0 and time.monotonic() >= next_check:
+                next_check = time.monotonic() + watch_interval
+                current = db_fingerprint()
+                if current != fingerprint:
+                    fingerprint = current
+                    print("[OK] Skill DB changed on disk, reloading workers")
+                    self._rolling_reload(sock, app)
+
+            # Poll instead of blocking in os.wait() so SIGHUP and the watcher are noticed
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            started, generation = worker
+            self.ready.discard(pid)
+            self._mark_dead(pid)
+            if pid in self.retiring:
+                self.retiring.remove(pid)
+            if self.stopping or generation != self.generation:
+                continue  # shutting down, or replaced by a reload
+            print(f"[WARN] Worker {pid} exited with status {status}, restarting")
+            if time.monotonic() - started < 1:
+                time.sleep(1)  # don't spin if workers die on startup
+            self.spawn(sock, app)
+
+    def _request_reload(self, *_):
+        self.reload_requested = True
+
+    def _preload(self, sock, app):
+        """Build the extractor while the first workers serve, then replace them with forks of the loaded parent."""
+        ok = self.main.load_extractor()
+        if self.stopping:
+            return
+        if ok:
+            # Move everything allocated so far out of the GC's reach: collections
+            # would otherwise write to every object header and un-share the pages
+            gc.collect()
+            gc.freeze()
+        else:
+            # Replace the workers anyway, so their health reports the failure instead of "loading"
+            print("[WARN] Could not load the skill extractor, /skillboy stays unavailable (POST /skillboy/reload to retry)")
+        os.environ["FUTURSCAM_PRELOAD"] = "done" if ok else "failed"
+        self._replace_workers(sock, app)
+        print(f"[OK] Skill extractor {'preloaded' if ok else 'not loaded'}, worker generation {self.generation} started")
+
+    def _rolling_reload(self, sock, app):
+        """Rebuild the extractor, start a new generation of workers, then retire the old one.
+
+        The old generation keeps accepting on the shared socket until every new
+        worker reported a ready extractor (with --no-preload each builds its own
+        before it starts accepting), and uvicorn finishes in-flight requests
+        before an old worker exits, so no request sees a missing extractor.
+        """
+        if self.args.preload:
+            gc.unfreeze()
+            if not self.main.reload_skill_db():
+                gc.freeze()
+                print("[WARN] Skill DB reload failed, keeping the current workers")
+                return
+            gc.collect()
+            gc.freeze()
+
+        self._replace_workers(sock, app)
+        print(f"[OK] Reloaded skill DB, worker generation {self.generation} started")
+
+    def _replace_workers(self, sock, app):
+        """Fork a new generation; the current one is stopped by _retire_when_ready."""
+        self.retiring += [pid for pid, (_, generation) in self.workers.items() if generation == self.generation]
+        self.retire_deadline = time.monotonic() + self.args.ready_timeout
+        self.generation += 1
+        for _ in range(self.args.workers):
+            self.spawn(sock, app)
+
+    def _read_ready(self):
+        """Collect the readiness reports workers wrote to the pipe."""
+        while True:
+            try:
+                data = os.read(self.ready_fd, 4096)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            *lines, self.ready_buffer = (self.ready_buffer + data).split(b"\n")
+            for line in lines:
+                pid, status = line.decode().split()
+                self.ready.add(int(pid))
+                if status != "ready":
+                    print(f"[WARN] Worker {pid} could not load the skill extractor")
+
+    def _retire_when_ready(self):
+        """Stop the previous generations once every current worker is ready, or after --ready-timeout."""
+        current = [pid for pid, (_, generation) in self.workers.items() if generation == self.generation]
+        if len(self.ready.intersection(current)) < self.args.workers:
+            if time.monotonic() < self.retire_deadline:
+                return
+            print(f"[WARN] New workers not ready after {self.args.ready_timeout:.0f}s, stopping the previous ones anyway")
+        for pid in self.retiring:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        self.retiring = []
+
+    def _stop(self, *_):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _report(self):
+        pids = [("parent", os.getpid())] + [("worker", pid) for pid in sorted(self.workers)]
+        print(memory_report(pids), flush=True)
+
+    @staticmethod
+    def _mark_dead(pid: int):
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the FuturScam API with pre-forked workers")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Let each worker load its own extractor (pre-launcher behaviour)")
+    parser.add_argument("--memory-report", type=int, default=0, metavar="SECONDS",
+                        help="Print per-worker memory this many seconds after startup")
+    parser.add_argument("--ready-timeout", type=float, default=300.0, metavar="SECONDS",
+                        help="How long a reload waits for new workers' extractors before stopping the old ones")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork(); use `uvicorn main:app` on this platform")
+    Launcher(parse_args(argv)).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Versioned skill extractor with its own extraction cache.
+
+A SkillEngine bundles everything derived from one version of the skill
+database: the skillNer extractor, the DB version and an LRU cache of
+extraction results. Reloading builds a new engine and swaps it in with a
+single assignment, so requests always see a consistent extractor + cache
+pair, and the old cache disappears with the old engine.
+
+spaCy and skillNer (via test.py) are only imported by SkillEngine.load, so
+importing this module (and main.py) stays fast.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from skill_store import CompactSkillDB
+
+SKILL_DB_PATH = "skill_db_optimized_20.json"
+TOKEN_DIST_PATH = "token_dist.json"
+
+# Steps of SkillEngine.load with their rough share of the load time (building matchers dominates)
+LOAD_STEPS = {
+    "importing": 0.15,
+    "reading_skill_db": 0.05,
+    "loading_spacy_model": 0.15,
+    "loading_token_vectors": 0.05,
+    "building_matchers": 0.60,
+}
+
+
+def db_version(paths=(SKILL_DB_PATH, TOKEN_DIST_PATH)) -> str:
+    """Content hash of the skill DB files (identical across workers and restarts)."""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            digest.update(b"-")
+    return digest.hexdigest()[:12]
+
+
+def db_fingerprint(paths=(SKILL_DB_PATH, TOKEN_DIST_PATH)) -> Tuple:
+    """Cheap change detector (mtime, size) for the file watcher."""
+    stamp = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+class SkillEngine:
+    """An extractor built from one skill DB version, plus its result cache."""
+
+    def __init__(self, skill_terms, extractor, version: str, load_seconds: float, cache_size: int = 1024):
+        from test import extract_skills
+
+        self._extract_skills = extract_skills
+        self.skill_terms = skill_terms
+        self.extractor = extractor
+        self.version = version
+        self.load_seconds = load_seconds
+        self.loaded_at = datetime.now(timezone.utc)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, skill_db_path: str = SKILL_DB_PATH, cache_size: int = 1024, compact: bool = False,
+             progress: Optional[Callable[[str], None]] = None) -> "SkillEngine":
+        """Build a new engine from the files on disk. Slow (seconds): run off the event loop.
+
+        compact=True keeps the skill DB as a CompactSkillDB instead of nested dicts
+        (less memory, slightly slower record lookups, see skill_store.py).
+        progress is called with each of LOAD_STEPS as it starts.
+        """
+        progress = progress or (lambda step: None)
+        start = time.perf_counter()
+        progress("importing")
+        from test import load_skill_terms, create_extractor
+
+        progress("reading_skill_db")
+        version = db_version((skill_db_path, TOKEN_DIST_PATH))
+        if compact:
+            skill_terms = CompactSkillDB.from_json(skill_db_path)
+        else:
+            skill_terms = load_skill_terms(skill_db_path)
+        extractor = create_extractor(skill_terms, progress)
+        return cls(skill_terms, extractor, version, time.perf_counter() - start, cache_size)
+
+    def extract(self, text: str) -> Tuple[List[str], bool]:
+        """Extract skills from text; returns (skills, cache_hit)."""
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return list(cached), True
+
+        skills = self._extract_skills(text, self.extractor)
+
+        if self.cache_size:
+            with self._lock:
+                self._cache[key] = tuple(skills)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return skills, False
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at.isoformat(),
+            "load_seconds": round(self.load_seconds, 3),
+            "skills": len(self.skill_terms),
+            "compact": isinstance(self.skill_terms, CompactSkillDB),
+            "cache_entries": len(self._cache),
+        }
+
+
+class LoadProgress:
+    """Current step of a SkillEngine.load, passed as its progress callback."""
+
+    def __init__(self):
+        self.step: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.failed: Optional[str] = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.step = next(iter(LOAD_STEPS))
+        self.failed = None
+
+    def __call__(self, step: str):
+        self.step = step
+
+    def finish(self, error: Optional[str] = None):
+        self.step = None
+        self.started_at = None
+        self.failed = error
+
+    @property
+    def active(self) -> bool:
+        return self.started_at is not None
+
+    def info(self) -> dict:
+        if not self.active:
+            return {"active": False}
+        steps = list(LOAD_STEPS)
+        done = steps.index(self.step) if self.step in LOAD_STEPS else 0
+        return {
+            "active": True,
+            "step": self.step,
+            "step_number": done + 1,
+            "steps": len(steps),
+            # Approximate, from the typical share of each step
+            "percent": round(100 * sum(LOAD_STEPS[step] for step in steps[:done])),
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 1),
+        }
+
+
+class ReloadState:
+    """Tracks the initial load and background reloads so /skillboy/health can report them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reloading = False
+        self.last_error: Optional[str] = None
+        self.last_attempt_at: Optional[datetime] = None
+        self.progress = LoadProgress()
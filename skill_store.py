@@ -0,0 +1,213 @@
+"""
+Compact in-memory skill database.
+
+load_skill_terms() keeps the JSON as ~5.4k nested dicts (a dict per skill, a
+dict for its high surface forms, a list of low surface forms) holding ~30k
+string objects, many of them duplicates ("Hard Skill", shared surface forms).
+CompactSkillDB stores the same data as:
+
+- a string table: every distinct string stored once
+- parallel arrays indexed by an integer skill id, holding string-table ids
+  (name, type, full / abv surface form) and small ints (skill_len, flags)
+- low surface forms as one flat id array plus per-skill offsets
+
+skillNer and extract_from_extractor still see a read-only mapping:
+`db[skill_id]["high_surfce_forms"]["full"]` works as with the dict. skillNer
+reads a record for every candidate match, so the records of the first
+HOT_RECORDS ids looked up (the common skills, in practice) are kept as plain
+dicts; the others are rebuilt on each access. Callers must not modify them. Fewer, larger objects also mean fewer pages dirtied by
+refcount and GC updates in workers forked by serve.py.
+
+Benchmark: python skill_store.py [skill_db_optimized_20.json]
+"""
+
+import json
+from array import array
+from collections.abc import Mapping
+
+NO_STRING = -1  # field absent from the JSON record
+
+# Records kept as dicts per process (~0.55 KB each; a job description looks up ~50)
+HOT_RECORDS = 2048
+
+# Record fields, in the order skillNer's records have them
+FIELDS = ("skill_name", "skill_type", "skill_len", "high_surfce_forms", "low_surface_forms", "match_on_tokens")
+
+
+class CompactSkillDB(Mapping):
+    """Read-only mapping skill_id -> record, backed by a string table and parallel arrays."""
+
+    __slots__ = ("_ids", "_keys", "strings", "names", "_name", "_type", "_len", "_full", "_abv",
+                 "_match", "_low_offsets", "_low", "_hot")
+
+    def __init__(self, records: dict):
+        table = {}
+        strings = []
+
+        def intern(value) -> int:
+            if value is None:
+                return NO_STRING
+            sid = table.get(value)
+            if sid is None:
+                sid = table[value] = len(strings)
+                strings.append(value)
+            return sid
+
+        self._keys = []
+        self._ids = {}
+        self.names = {}  # skill_id -> skill_name, for extract_from_extractor's per-match lookups
+        self._name, self._type, self._full, self._abv = array("i"), array("i"), array("i"), array("i")
+        self._len, self._match = array("h"), array("b")
+        self._low_offsets, self._low = array("I", [0]), array("I")
+
+        for key, info in records.items():
+            self._ids[key] = len(self._keys)
+            self._keys.append(key)
+            name = info.get("skill_name")
+            # Same rule as test.load_skill_terms: skill_len is the number of words in the name
+            skill_len = len(name.split()) if name is not None else info.get("skill_len", NO_STRING)
+            forms = info.get("high_surfce_forms") or {}
+            self._name.append(intern(name))
+            if name is not None:
+                self.names[key] = strings[self._name[-1]]
+            self._type.append(intern(info.get("skill_type")))
+            self._len.append(skill_len)
+            self._full.append(intern(forms.get("full")))
+            self._abv.append(intern(forms.get("abv")))
+            self._match.append(1 if info.get("match_on_tokens") else 0)
+            self._low.extend(intern(form) for form in info.get("low_surface_forms") or ())
+            self._low_offsets.append(len(self._low))
+
+        self.strings = tuple(strings)
+        self._hot = {}
+
+    @classmethod
+    def from_json(cls, json_path: str) -> "CompactSkillDB":
+        with open(json_path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    # Mapping interface (what skillNer uses)
+
+    def __getitem__(self, skill_id):
+        record = self._hot.get(skill_id)
+        if record is None:
+            record = self._build_record(skill_id)
+            # Filled once and never evicted, so concurrent readers need no lock
+            if len(self._hot) < HOT_RECORDS:
+                self._hot[skill_id] = record
+        return record
+
+    def __contains__(self, skill_id):
+        return skill_id in self._ids
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _build_record(self, skill_id) -> dict:
+        """The JSON record of a skill (fields in FIELDS order)."""
+        i = self._ids[skill_id]
+        strings = self.strings
+        record = {}
+        if self._name[i] != NO_STRING:
+            record["skill_name"] = strings[self._name[i]]
+        if self._type[i] != NO_STRING:
+            record["skill_type"] = strings[self._type[i]]
+        record["skill_len"] = self._len[i]
+        forms = {}
+        if self._full[i] != NO_STRING:
+            forms["full"] = strings[self._full[i]]
+        if self._abv[i] != NO_STRING:
+            forms["abv"] = strings[self._abv[i]]
+        record["high_surfce_forms"] = forms
+        record["low_surface_forms"] = self.low_surface_forms(i)
+        record["match_on_tokens"] = bool(self._match[i])
+        return record
+
+    def low_surface_forms(self, index: int) -> list:
+        strings = self.strings
+        return [strings[sid] for sid in self._low[self._low_offsets[index]:self._low_offsets[index + 1]]]
+
+
+def name_lookup(skills_db):
+    """Function skill_id -> skill_name (None if unknown) for either representation.
+
+    With CompactSkillDB this is a single dict lookup, instead of building a record view.
+    """
+    if isinstance(skills_db, CompactSkillDB):
+        return skills_db.names.get
+
+    def lookup(skill_id):
+        info = skills_db.get(skill_id)
+        return info.get("skill_name") if info is not None else None
+    return lookup
+
+
+# ==========================================================
+# Benchmark
+# ==========================================================
+if __name__ == "__main__":
+    import sys
+    import time
+    import tracemalloc
+
+    from test import load_skill_terms
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "skill_db_optimized_20.json"
+
+    def measure(build):
+        tracemalloc.start()
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return result, size
+
+    # Measure the resident structure only: parse the JSON first, outside tracing
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    as_dicts, dict_bytes = measure(lambda: load_skill_terms(path))
+    compact, compact_bytes = measure(lambda: CompactSkillDB(json.loads(raw)))
+
+    print(f"📌 {len(compact)} skills, {len(compact.strings)} distinct strings")
+    print(f"   dicts   : {dict_bytes / 1e6:6.2f} MB")
+    print(f"   compact : {compact_bytes / 1e6:6.2f} MB  ({100 * (1 - compact_bytes / dict_bytes):.0f}% less)")
+
+    # Hot: ids within the record cache, as for the matches of typical texts. Cold: every id,
+    # so each record is rebuilt
+    hot_ids = list(as_dicts)[:HOT_RECORDS // 2] * 200
+    cold_ids = list(as_dicts) * 20
+
+    def per_lookup(loop, ids) -> float:
+        """Best of 5 runs, in ns per skill id."""
+        best = min(timeit(lambda: loop(ids)) for _ in range(5))
+        return 1e9 * best / len(ids)
+
+    def timeit(loop) -> float:
+        start = time.perf_counter()
+        loop()
+        return time.perf_counter() - start
+
+    for label, db in (("dicts", as_dicts), ("compact", compact)):
+        lookup = name_lookup(db)
+
+        def mapping(ids):
+            for skill_id in ids:
+                if skill_id in db:
+                    db[skill_id]["high_surfce_forms"]["full"]
+
+        def direct(ids):
+            for skill_id in ids:
+                lookup(skill_id)
+
+        print(f"   {label:8}: db[id]['high_surfce_forms']['full'] hot {per_lookup(mapping, hot_ids):4.0f} ns, "
+              f"cold {per_lookup(mapping, cold_ids):4.0f} ns; name_lookup {per_lookup(direct, cold_ids):4.0f} ns")
+
+    compact._hot.clear()
+    _, cache_bytes = measure(lambda: [compact[skill_id] for skill_id in list(compact)[:HOT_RECORDS]])
+    print(f"   compact record cache when full: {cache_bytes / 1e6:.2f} MB ({HOT_RECORDS} records)")
+
+    mismatches = [k for k in as_dicts if dict(as_dicts[k], high_surfce_forms=dict(as_dicts[k]["high_surfce_forms"]))
+                  != {f: (dict(v) if f == "high_surfce_forms" else v) for f, v in compact[k].items()}]
+    print(f"   records identical: {not mismatches}")
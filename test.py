@@ -5,6 +5,8 @@ from skillNer.skill_extractor_class import SkillExtractor
 from spacy.matcher import PhraseMatcher
 import numpy as np
 
+from skill_store import name_lookup
+
 # Désactiver les warnings de word vectors
 warnings.filterwarnings("ignore", category=UserWarning, module="skillNer.utils")
 
@@ -16,24 +18,28 @@ def extract_from_extractor(extractor, text, tresh=0.5):
     res = extractor.annotate(text, tresh=tresh)
 
     skills = []
+    # skill_id -> skill_name, a single dict lookup with CompactSkillDB
+    skill_name = name_lookup(extractor.skills_db)
     
     # Handle full_matches safely
     for m in res['results'].get('full_matches', []):
         skill_id = m.get('skill_id')
-        if skill_id and skill_id in extractor.skills_db:
+        name = skill_name(skill_id) if skill_id else None
+        if name is not None:
             skills.append({
                 "skill_id": skill_id,
-                "skill_name": extractor.skills_db[skill_id]['skill_name'],
+                "skill_name": name,
                 "type": "full",
             })
     
     # Handle ngram_scored safely
     for m in res['results'].get('ngram_scored', []):
         skill_id = m.get('skill_id')
-        if skill_id and skill_id in extractor.skills_db:
+        name = skill_name(skill_id) if skill_id else None
+        if name is not None:
             skills.append({
                 "skill_id": skill_id,
-                "skill_name": extractor.skills_db[skill_id]['skill_name'],
+                "skill_name": name,
                 "type": "ngram",
                 "score": m.get("score", 1),
             })
@@ -60,11 +66,16 @@ def load_skill_terms(json_path="skill_db_optimized_20.json"):
 # ==========================================================
 # Créer le SkillExtractor
 # ==========================================================
-def create_extractor(skill_terms):
+def create_extractor(skill_terms, progress=None):
+    # progress(step) : étape en cours, pour /skillboy/health (voir skill_engine.LOAD_STEPS)
+    progress = progress or (lambda step: None)
+
     # Charger spaCy sans les composants inutiles pour plus de vitesse
+    progress("loading_spacy_model")
     nlp = spacy.load("en_core_web_sm", disable=["ner"])
     
     # Charger les token distances si disponibles
+    progress("loading_token_vectors")
     try:
         with open("token_dist.json", "r", encoding="utf-8") as f:
             token_dist = json.load(f)
@@ -91,6 +102,7 @@ def create_extractor(skill_terms):
     
     # Pass the PhraseMatcher class (SkillExtractor will instantiate it
     # internally with the expected args: e.g. PhraseMatcher(nlp.vocab, attr="LOWER"))
+    progress("building_matchers")
     return SkillExtractor(nlp, skills_db=skill_terms, phraseMatcher=PhraseMatcher)
 
 
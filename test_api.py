@@ -31,24 +31,28 @@ def test_skill_extraction():
     response = requests.post(f"{BASE_URL}/skillboy", json=payload)
     print(f"Status: {response.status_code}")
     result = response.json()
-    print(f"Extracted {result['count']} skills:")
+    print(f"Extracted {result['skills_count']} skills:")
     for skill in result['skills']:
         print(f"  - {skill}")
+    print(f"Languages: {result['languages']}")
 
 def test_create_rfp():
     """Test RFP creation"""
     print("\n[TEST] Create RFP")
     payload = {
-        "role": "Senior Data Engineer",
-        "company_name": "TechCorp",
-        "company_city": "Paris",
-        "job_description": "Looking for a data engineer with Python, Spark, and AWS knowledge",
+        "company": {"city": "Paris", "name": "TechCorp"},
+        "conditions": {"fromAt": "2026-01-01", "toAt": "2026-06-30"},
+        "deadlineAt": "2025-12-15",
+        "publishedAt": "2025-12-01",
+        "job_id": "test-api-rfp",
+        "job_desc": "Looking for a data engineer with Python, Spark, and AWS knowledge",
+        "roleTitle": "Senior Data Engineer",
         "skills": [
-            {"name": "Python", "level": "Expert"},
-            {"name": "Spark", "level": "Advanced"}
+            {"name": "Python", "seniority": "Expert"},
+            {"name": "Spark", "seniority": "Advanced"}
         ],
         "languages": [
-            {"name": "English", "level": "Fluent"}
+            {"language": "English", "level": "Fluent"}
         ]
     }
     
@@ -64,13 +68,21 @@ def test_get_all_rfps():
     data = response.json()
     print(f"Total RFPs: {data['count']}")
     if data['data']:
-        print(f"First RFP: {data['data'][0]['role']} at {data['data'][0]['company_name']}")
+        print(f"First RFP: {data['data'][0].get('roleTitle')} at {data['data'][0].get('company', {}).get('name')}")
+
+def test_delete_rfp():
+    """Remove the RFP created by test_create_rfp"""
+    print("\n[TEST] Delete RFP")
+    response = requests.delete(f"{BASE_URL}/mongodb/test-api-rfp")
+    print(f"Status: {response.status_code}")
+    print(f"Response: {response.json()}")
 
 if __name__ == "__main__":
     print("=" * 60)
     print("FuturScam API - Test Suite")
     print("=" * 60)
     print("\nNote: Make sure the API is running first!")
+    print("For throughput and latency under load, see loadtest.py")
     print("Run: uvicorn main:app --reload")
     
     try:
@@ -79,6 +91,7 @@ if __name__ == "__main__":
         test_skill_extraction()
         test_create_rfp()
         test_get_all_rfps()
+        test_delete_rfp()
         print("\n" + "=" * 60)
         print("All tests completed!")
         print("=" * 60)
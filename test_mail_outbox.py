@@ -0,0 +1,185 @@
+"""
+Tests for the persistent mail outbox, against mongomock and the local Graph stub.
+
+Usage: pytest test_mail_outbox.py
+"""
+
+import asyncio
+import threading
+import time
+from datetime import timedelta
+
+import mongomock
+import mongomock.gridfs
+import pytest
+from bson.objectid import ObjectId
+
+import graph_stub
+from mail_outbox import (
+    RATE_STATE_ID, STATUS_FAILED, STATUS_QUEUED, STATUS_SENDING, STATUS_SENT, MailOutbox, _now,
+)
+import mail_sender
+from mail_sender import MailSender
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+@pytest.fixture
+def graph():
+    """A Graph stub on a free port; tweak its behaviour through graph.state."""
+    server = graph_stub.make_server("127.0.0.1", 0)
+    server.state = server.RequestHandlerClass.state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().outbox_tests
+
+
+def make_outbox(db, graph, **options) -> MailOutbox:
+    def sender_factory():
+        sender = MailSender("client", "authority", "secret", "mailbox@example.com", [],
+                            graph_url=f"http://127.0.0.1:{graph.server_address[1]}/v1.0",
+                            static_token="test")
+        sender.authenticate()
+        return sender
+
+    options.setdefault("rate_per_minute", 0)
+    return MailOutbox(db, sender_factory, **options)
+
+
+def send_next(outbox: MailOutbox) -> dict:
+    """Claim and process the next due message like a worker would; returns its final document."""
+    doc = outbox._claim()
+    assert doc is not None, "no message due"
+    outbox._process(doc)
+    return outbox.collection.find_one({"_id": doc["_id"]})
+
+
+def make_due(outbox: MailOutbox, message_id: str):
+    outbox.collection.update_one({"_id": ObjectId(message_id)}, {"$set": {"next_attempt_at": _now()}})
+
+
+def test_enqueue_is_sent_by_the_workers(db, graph):
+    outbox = make_outbox(db, graph, poll_interval=0.05)
+
+    async def scenario():
+        await outbox.start()
+        message_id = await asyncio.to_thread(
+            outbox.enqueue, ["alice@example.com"], "Hello", "<p>Hi</p>", [("notes.txt", b"some notes")]
+        )
+        for _ in range(100):
+            if outbox.get(message_id)["status"] == STATUS_SENT:
+                break
+            await asyncio.sleep(0.05)
+        await outbox.stop()
+        return message_id
+
+    message_id = asyncio.run(scenario())
+    status = outbox.get(message_id)
+    assert status["status"] == STATUS_SENT and status["attempts"] == 1
+    assert graph.state.sent == [{
+        "mailbox": "mailbox@example.com", "subject": "Hello", "to": ["alice@example.com"],
+        "attachments": [{"name": "notes.txt", "size": 10}],
+    }]
+    # A sent message's attachments are deleted
+    assert list(db["MailOutboxFiles.files"].find()) == []
+
+
+def test_server_error_is_retried_then_sent(db, graph):
+    outbox = make_outbox(db, graph)
+    message_id = outbox.enqueue(["bob@example.com"], "Retry", "body")
+
+    graph.state.fail_rate = 1.0
+    doc = send_next(outbox)
+    assert doc["status"] == STATUS_QUEUED and doc["attempts"] == 1
+    assert "503" in doc["last_error"]
+    assert doc["next_attempt_at"] > _now().replace(tzinfo=None)  # backed off
+    assert outbox._claim() is None
+
+    graph.state.fail_rate = 0.0
+    make_due(outbox, message_id)
+    doc = send_next(outbox)
+    assert doc["status"] == STATUS_SENT and doc["attempts"] == 2 and doc["last_error"] is None
+    assert len(graph.state.sent) == 1
+
+
+def test_client_error_fails_without_retry(db, graph):
+    outbox = make_outbox(db, graph)
+    outbox.enqueue(["carol@example.com"], "Unauthorized", "body")
+    outbox.sender_factory = lambda: MailSender("client", "authority", "secret", "mailbox@example.com", [])
+
+    doc = send_next(outbox)
+    assert doc["status"] == STATUS_FAILED and doc["attempts"] == 1
+    assert graph.state.sent == []
+
+
+def test_throttling_pauses_every_sender(db, graph):
+    outbox = make_outbox(db, graph, rate_per_minute=600)
+    sibling = make_outbox(db, graph, rate_per_minute=600)  # another process on the same mailbox
+    outbox.enqueue(["dave@example.com"], "Throttled", "body")
+
+    graph.state.throttle_rate = 1.0  # 429 with Retry-After: 1
+    before = time.time()
+    doc = send_next(outbox)
+    assert doc["status"] == STATUS_QUEUED and "429" in doc["last_error"]
+
+    paused_until = db["MailOutboxState"].find_one({"_id": RATE_STATE_ID})["paused_until"]
+    assert before + 1 <= paused_until <= time.time() + 1
+    assert 0 < sibling._pause_left() <= 1
+    # The sibling's next slot is booked after the pause, not now
+    assert sibling._reserve_send_slot() >= paused_until - time.time() - 0.05
+
+
+def test_recover_requeues_expired_leases_only(db, graph):
+    outbox = make_outbox(db, graph, lease_seconds=30)
+    for name in ("expired", "live", "legacy"):
+        outbox.enqueue([f"{name}@example.com"], name, "body")
+    now = _now()
+    outbox.collection.update_many({}, {"$set": {"status": STATUS_SENDING, "claimed_by": "other-host:1:abcd"}})
+    outbox.collection.update_one({"subject": "expired"}, {"$set": {"lease_expires_at": now - timedelta(seconds=1)}})
+    outbox.collection.update_one({"subject": "live"}, {"$set": {"lease_expires_at": now + timedelta(seconds=30)}})
+    # Messages claimed before leases existed have no lease_expires_at
+
+    assert outbox._recover() == 2
+    statuses = {doc["subject"]: doc["status"] for doc in outbox.collection.find()}
+    assert statuses == {"expired": STATUS_QUEUED, "live": STATUS_SENDING, "legacy": STATUS_QUEUED}
+    assert outbox.collection.find_one({"subject": "live"})["claimed_by"] == "other-host:1:abcd"
+    assert outbox.collection.find_one({"subject": "expired"})["claimed_by"] is None
+
+
+def test_batch_attachments_are_kept_until_the_last_message_finishes(db, graph):
+    outbox = make_outbox(db, graph)
+    messages = [{"to": f"user{i}@example.com", "subject": f"Offer {i}", "body": "body"} for i in range(3)]
+    batch_id, _ = outbox.enqueue_batch(messages, [("offer.pdf", b"%PDF-1.4 offer")])
+    files = db["MailOutboxFiles.files"]
+    assert files.count_documents({}) == 1
+
+    send_next(outbox)
+    graph.state.fail_rate = 1.0
+    outbox.max_attempts = 1  # the second message fails for good: it is finished too
+    assert send_next(outbox)["status"] == STATUS_FAILED
+    assert files.count_documents({}) == 1
+
+    graph.state.fail_rate = 0.0
+    send_next(outbox)
+    assert files.count_documents({}) == 0
+    batch = outbox.get_batch(batch_id)
+    assert batch["done"] and batch["totals"][STATUS_SENT] == 2 and batch["totals"][STATUS_FAILED] == 1
+    assert [m["attachments"] for m in graph.state.sent] == [[{"name": "offer.pdf", "size": 14}]] * 2
+
+
+def test_oversized_attachment_fails_instead_of_being_dropped(db, graph, monkeypatch):
+    monkeypatch.setattr(mail_sender, "UPLOAD_SESSION_LIMIT", 16)
+    outbox = make_outbox(db, graph)
+    outbox.enqueue(["erin@example.com"], "Too big", "body", [("small.txt", b"ok"), ("big.bin", b"x" * 17)])
+
+    doc = send_next(outbox)
+    assert doc["status"] == STATUS_FAILED and doc["attempts"] == 1
+    assert "big.bin" in doc["last_error"]
+    assert graph.state.sent == []
@@ -0,0 +1,137 @@
+"""
+Partial, versioned updates for the job, staging and user collections.
+
+- Nested changes are flattened into dotted-path $sets, so updating
+  company.city leaves the rest of `company` untouched. A nested object with
+  no fields left (e.g. only nulls were sent) changes nothing.
+- Skills can be added or removed by name without sending the whole array.
+  Each added skill is one atomic $push guarded by its name, so a name that
+  is already listed (even by a concurrent request) changes nothing.
+- Every update that changes the document increments a `version` field;
+  one that changes nothing (same values, skills already listed or absent)
+  leaves it alone and is reported as not modified. Clients send the version
+  back in If-Match (the ETag of their GET/PUT/PATCH response); if the document
+  changed in the meantime the update is refused with 412 instead of
+  silently overwriting the other editor's changes. Without If-Match the
+  last write wins, as before.
+- The updated document is returned (find_one_and_update), so clients
+  don't need a follow-up GET.
+
+Documents written before versioning have no `version` field and count as version 0.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+VERSION_FIELD = "version"
+
+_ETAG = re.compile(r'^(?:W/)?"?(\d+)"?$')
+
+
+def flatten_update(data: dict, prefix: str = "") -> dict:
+    """{"company": {"city": "Gent"}} -> {"company.city": "Gent"}. Lists are set whole, empty dicts dropped."""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            # Setting {} would wipe the whole subdocument
+            flat.update(flatten_update(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def doc_version(doc: dict) -> int:
+    return doc.get(VERSION_FIELD) or 0
+
+
+def etag(doc: dict) -> str:
+    return f'"{doc_version(doc)}"'
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Expected version from an If-Match header; None when absent or "*" (no check)."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    match = _ETAG.match(if_match.strip())
+    if not match:
+        raise HTTPException(status_code=400, detail=f"Invalid If-Match header: {if_match}")
+    return int(match.group(1))
+
+
+def version_filter(version: int) -> dict:
+    # null also matches documents without the field
+    return {VERSION_FIELD: {"$in": [0, None]}} if version == 0 else {VERSION_FIELD: version}
+
+
+def update_document(collection, query: dict, data: dict, if_match: Optional[str] = None,
+                    not_found: str = "Document not found") -> Tuple[dict, bool]:
+    """Apply an update model dump (with optional add_skills / remove_skills).
+
+    Returns the new document and whether anything changed. Raises 400 for an
+    empty or contradictory update, 404 if no document matches and 412 if
+    If-Match doesn't match the current version.
+    """
+    data = dict(data)
+    add_skills: List[dict] = data.pop("add_skills", None) or []
+    remove_skills: List[str] = data.pop("remove_skills", None) or []
+    fields = flatten_update(data)
+    if not fields and not add_skills and not remove_skills:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    if "skills" in fields and (add_skills or remove_skills):
+        raise HTTPException(status_code=400, detail="Send either skills or add_skills/remove_skills, not both")
+
+    expected = parse_if_match(if_match)
+    # Once we changed the document, our own writes have moved its version on
+    guard = version_filter(expected) if expected is not None else {}
+    doc = None
+
+    if fields or remove_skills:
+        update = {"$inc": {VERSION_FIELD: 1}}
+        # Only match when something would actually change
+        changes = [{path: {"$ne": value}} for path, value in fields.items()]
+        if fields:
+            update["$set"] = fields
+        if remove_skills:
+            update["$pull"] = {"skills": {"name": {"$in": remove_skills}}}
+            changes.append({"skills.name": {"$in": remove_skills}})
+        doc = collection.find_one_and_update(
+            dict(query, **guard, **{"$or": changes}), update, return_document=ReturnDocument.AFTER
+        )
+        if doc is not None:
+            guard = {}
+
+    for skill in add_skills:
+        # Skills are unique by name, which $addToSet (whole-subdocument equality) can't enforce
+        added = collection.find_one_and_update(
+            dict(query, **guard, **{"skills.name": {"$ne": skill["name"]}}),
+            {"$push": {"skills": skill}, "$inc": {VERSION_FIELD: 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if added is not None:
+            doc, guard = added, {}
+
+    if doc is not None:
+        return doc, True
+    # Nothing matched: missing document, version conflict, or nothing to change
+    return _current_or_raise(collection, query, expected, not_found), False
+
+
+def _current_or_raise(collection, query, expected, not_found) -> dict:
+    current = collection.find_one(query)
+    if current is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    if expected is not None and doc_version(current) != expected:
+        _raise_conflict(doc_version(current))
+    return current
+
+
+def _raise_conflict(version: int):
+    raise HTTPException(
+        status_code=412,
+        detail=f"Document was modified (current version {version}), reload and retry",
+        headers={"ETag": f'"{version}"'},
+    )